@@ -2,6 +2,7 @@ import sys
 import json
 import os
 import uuid
+import hashlib
 from datetime import datetime, date, timedelta
 from collections import defaultdict
 
@@ -31,6 +32,7 @@ except ImportError:
 try:
     import firebase_admin
     from firebase_admin import credentials, firestore
+    from google.api_core.exceptions import AlreadyExists
     FIREBASE_AVAILABLE = True
 except ImportError:
     FIREBASE_AVAILABLE = False
@@ -96,12 +98,25 @@ def dt_now_iso():
 # DATA HANDLER
 # --------------------------
 
+# Online, each change to a profile is appended to users/{uid}/journal as one small entry
+# (op, transaction or settings, version, timestamp) instead of rewriting the profile.
+# The full profile is written as a snapshot, stamped with its version, only every
+# JOURNAL_SNAPSHOT_EVERY changes or when a save isn't a single change (imports, repairs),
+# and the entries it covers are deleted then. Loading reads the snapshot and replays the
+# entries after it. Entries are created, never overwritten, so two devices saving the
+# same version can't both succeed: the later one catches up and applies its change again.
+# Deleted entries free their version numbers, so each save also checks, in the same
+# transaction, that no snapshot has already covered the version it is about to write.
+JOURNAL_SNAPSHOT_EVERY = 20
+
 class OnlineCoinTracker:
     def __init__(self, profile_name="Default", user_id="default_user"):
         self.profile_name = profile_name
         self.user_id = user_id
         self.db = None
         self.transactions = []
+        self.journal_version = 0   # version of self.transactions and self.settings
+        self.snapshot_version = 0  # version of the last full snapshot
         self.settings = {
             "goal": 13500,
             "dark_mode": False,
@@ -224,14 +239,7 @@ class OnlineCoinTracker:
 
         if self.db and FIREBASE_AVAILABLE:
             try:
-                doc_ref = self.db.collection('users').document(self.user_id)
-                doc = doc_ref.get()
-                if doc.exists:
-                    data = doc.to_dict()
-                    profiles_data = data.get('profiles', {})
-                    profile_data = profiles_data.get(self.profile_name, {})
-                    self.transactions = profile_data.get('transactions', [])
-                    loaded_settings = profile_data.get('settings', {})
+                loaded_settings = self.load_remote()
             except Exception as e:
                 print(f"Online load error for profile '{self.profile_name}': {e}")
                 self.load_local_data() 
@@ -243,31 +251,116 @@ class OnlineCoinTracker:
         
         self.validate_and_fix_data()
 
-    def save_data(self, recalculate=True):
+    def journal_entry_id(self, version):
+        # Profile names can hold characters a document id can't, so they are hashed.
+        return f"{hashlib.sha1(self.profile_name.encode('utf-8')).hexdigest()[:16]}-{version:010d}"
+
+    def load_remote(self):
+        """Loads the profile's snapshot and replays the journal entries after it; returns its settings."""
+        user_ref = self.db.collection('users').document(self.user_id)
+        while True:
+            doc = user_ref.get()
+            profile_data = (doc.to_dict().get('profiles', {}) if doc.exists else {}).get(self.profile_name, {})
+            self.transactions = profile_data.get('transactions', [])
+            settings = dict(profile_data.get('settings', {}))
+            self.snapshot_version = self.journal_version = profile_data.get('journal_version', 0)
+            if self.replay_journal(user_ref, settings):
+                self.recalculate_balances()
+                return settings
+
+    def replay_journal(self, user_ref, settings):
+        """Applies the entries after self.journal_version; False if a newer snapshot deleted some of them meanwhile."""
+        journal = user_ref.collection('journal')
+        while True:
+            refs = [journal.document(self.journal_entry_id(v))
+                    for v in range(self.journal_version + 1, self.journal_version + JOURNAL_SNAPSHOT_EVERY + 1)]
+            entries = {snap.id: snap.to_dict() for snap in self.db.get_all(refs) if snap.exists}
+            for ref in refs:
+                if ref.id not in entries:
+                    # A gap is either the end of the journal or entries a newer snapshot covers.
+                    return self.remote_snapshot_version(user_ref) <= self.journal_version
+                self.apply_change(entries[ref.id], settings)
+                self.journal_version = entries[ref.id]['version']
+
+    def remote_snapshot_version(self, user_ref, transaction=None):
+        field = firestore.FieldPath('profiles', self.profile_name, 'journal_version').to_api_repr()
+        doc = user_ref.get(field_paths=[field], transaction=transaction)
+        return ((doc.to_dict() or {}).get('profiles', {}) if doc.exists else {}).get(self.profile_name, {}).get('journal_version', 0)
+
+    def apply_change(self, change, settings):
+        op = change['op']
+        if op in ('transaction_added', 'transaction_updated'):
+            transaction = dict(change['transaction'])
+            self.transactions = [t for t in self.transactions if t.get('id') != transaction['id']] + [transaction]
+        elif op == 'transaction_deleted':
+            self.transactions = [t for t in self.transactions if t.get('id') != change['transaction_id']]
+        elif op == 'settings_changed':
+            settings.update(change['settings'])
+
+    def save_data(self, recalculate=True, change=None):
+        """Saves the profile. change is the journal entry's op and payload; without one the whole profile is written."""
         if recalculate:
             self.recalculate_balances()
 
         if self.db and FIREBASE_AVAILABLE:
             try:
-                doc_ref = self.db.collection('users').document(self.user_id)
-                doc = doc_ref.get()
-
-                profiles_data = doc.to_dict().get('profiles', {}) if doc.exists else {}
-
-                profile_data = {
-                    'transactions': self.transactions,
-                    'settings': self.settings,
-                    'last_updated': dt_now_iso()
-                }
-
-                profiles_data[self.profile_name] = profile_data
-                doc_ref.set({'profiles': profiles_data, 'last_updated': dt_now_iso()}, merge=True)
+                for attempt in range(3):
+                    try:
+                        self.commit_change(change)
+                        break
+                    except AlreadyExists:
+                        # Another device saved this version, or a snapshot past it, first: catch up, then redo this change on top.
+                        transactions, settings = self.transactions, self.settings
+                        self.settings = {**self.settings, **self.load_remote()}
+                        if change is None:
+                            self.transactions, self.settings = transactions, settings
+                        else:
+                            self.apply_change(change, self.settings)
+                        self.recalculate_balances()
+                else:
+                    raise RuntimeError("profile kept changing on other devices")
             except Exception as e:
                 print(f"❌ Online save error for profile '{self.profile_name}': {e}")
                 self.save_local_data(recalculate=False)
         else:
             self.save_local_data(recalculate=False)
 
+    def commit_change(self, change):
+        version = self.journal_version + 1
+        user_ref = self.db.collection('users').document(self.user_id)
+        journal = user_ref.collection('journal')
+        entry = dict(change or {'op': 'profile_replaced'})
+        if 'transaction' in entry:
+            entry['transaction'] = {k: v for k, v in entry['transaction'].items() if k != 'previous_balance'}
+        entry.update({'profile': self.profile_name, 'version': version, 'timestamp': dt_now_iso()})
+
+        snapshot = change is None or version - self.snapshot_version >= JOURNAL_SNAPSHOT_EVERY
+
+        def commit(transaction):
+            remote_snapshot = self.remote_snapshot_version(user_ref, transaction)
+            if remote_snapshot >= version:
+                # Its entries may be gone, so creating this one would succeed and never be replayed.
+                raise AlreadyExists(f"profile snapshot is already at version {remote_snapshot}")
+            transaction.create(journal.document(self.journal_entry_id(version)), entry)
+            if snapshot:
+                transaction.set(user_ref, {
+                    'profiles': {self.profile_name: {
+                        'transactions': self.transactions,
+                        'settings': self.settings,
+                        'last_updated': dt_now_iso(),
+                        'journal_version': version,
+                    }},
+                    'last_updated': dt_now_iso(),
+                }, merge=True)
+                # The newest entry stays, so this version can't be claimed again.
+                for old_version in range(max(remote_snapshot, 1), version):
+                    transaction.delete(journal.document(self.journal_entry_id(old_version)))
+
+        firestore.transactional(commit)(self.db.transaction())
+        self.journal_version = version
+        if snapshot:
+            self.snapshot_version = version
+
     def load_local_data(self):
         default_settings = self.settings.copy()
         loaded_settings = {}
@@ -306,14 +399,14 @@ class OnlineCoinTracker:
         if amount == 0: return False
         transaction = {"id": str(uuid.uuid4()), "date": date or dt_now_iso(), "amount": amount, "source": source}
         self.transactions.append(transaction)
-        self.save_data(recalculate=True)
+        self.save_data(recalculate=True, change={'op': 'transaction_added', 'transaction': transaction})
         return True
 
     def update_transaction(self, transaction_id, new_data):
         for t in self.transactions:
             if t.get('id') == transaction_id:
                 t.update(new_data)
-                self.save_data(recalculate=True)
+                self.save_data(recalculate=True, change={'op': 'transaction_updated', 'transaction': t})
                 return True
         return False
 
@@ -321,7 +414,7 @@ class OnlineCoinTracker:
         initial_len = len(self.transactions)
         self.transactions = [t for t in self.transactions if t.get('id') != transaction_id]
         if len(self.transactions) < initial_len:
-            self.save_data(recalculate=True)
+            self.save_data(recalculate=True, change={'op': 'transaction_deleted', 'transaction_id': transaction_id})
             return True
         return False
 
@@ -375,14 +468,14 @@ class OnlineCoinTracker:
 
     def set_goal(self, goal_value: int):
         self.settings["goal"] = max(0, int(goal_value))
-        self.save_data(recalculate=False)
+        self.save_data(recalculate=False, change={'op': 'settings_changed', 'settings': self.settings})
 
     def get_goal(self) -> int:
         return int(self.settings.get("goal", 13500))
 
     def set_dark_mode(self, enabled: bool):
         self.settings["dark_mode"] = bool(enabled)
-        self.save_data(recalculate=False)
+        self.save_data(recalculate=False, change={'op': 'settings_changed', 'settings': self.settings})
 
     def get_dark_mode(self) -> bool:
         return bool(self.settings.get("dark_mode", False))
@@ -2262,7 +2355,7 @@ class MainWindow(QMainWindow):
          if dialog.exec_() == QDialog.Accepted:
               updated_actions = dialog.get_updated_actions()
               self.tracker.settings['quick_actions'] = updated_actions
-              self.tracker.save_data(recalculate=False)
+              self.tracker.save_data(recalculate=False, change={'op': 'settings_changed', 'settings': self.tracker.settings})
               self.update_modern_quick_actions()
               self.show_toast("Quick actions updated successfully", "success")
 
@@ -1,31 +1,249 @@
 import os
+import io
+import csv
+import gzip
+import json
+import asyncio
+import math
+import time
 import uuid
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+import hashlib
+import heapq
+import logging
+import random
+import pstats
+import cProfile
+import tracemalloc
+import zlib
+import threading
+import secrets
+import sqlite3
+import tempfile
+import queue
+import importlib.util
+import click
+from flask import Blueprint, Flask, Response, render_template, request, session, redirect, url_for, stream_with_context, g, has_app_context, has_request_context, current_app
 from datetime import datetime, date, timedelta, timezone
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from functools import wraps
+from urllib.parse import quote
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.datastructures import CallbackDict
+from werkzeug.test import EnvironBuilder
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+
+# --- Firebase SDK ---
+# Importing firebase_admin and google-cloud-firestore is the slowest part of start-up,
+# so it is deferred to the first get_db() call (see Firebase Initialization).
+FIREBASE_AVAILABLE = importlib.util.find_spec('firebase_admin') is not None
+FIRESTORE_ASYNC_AVAILABLE = False
+firebase_admin = credentials = firestore = firestore_async = AlreadyExists = None # bound by import_firebase_sdk()
+
+# --- Optional Serialization / Compression Libraries ---
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
-# --- Firebase Initialization ---
 try:
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-    FIREBASE_AVAILABLE = True
+    import brotli
+    BROTLI_AVAILABLE = True
 except ImportError:
-    FIREBASE_AVAILABLE = False
+    BROTLI_AVAILABLE = False
 
-app = Flask(__name__,
-    template_folder='templates',
-    static_folder='static'
-)
-app.secret_key = os.environ.get('SECRET_KEY', 'a-very-secret-key-for-dev')
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+# --- Optional Shared Store (rate limits across workers) ---
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Routes, hooks and CLI commands live on this blueprint; create_app() at the bottom of
+# the module builds the Flask app around it.
+bp = Blueprint('coin_tracker', __name__, cli_group=None)
+
+# --- Firestore Instrumentation ---
+FIRESTORE_READ_METHODS = {'get', 'get_all', 'stream', 'collections', 'list_documents'}
+FIRESTORE_WRITE_METHODS = {'set', 'update', 'delete', 'create'}
+FIRESTORE_PROXIED_TYPES = {
+    'Client', 'CollectionReference', 'DocumentReference', 'Query', 'CollectionGroup',
+    'AggregationQuery', 'WriteBatch', 'Transaction',
+}
+
+class FirestoreStats:
+    """Firestore work done on behalf of a single request."""
+    __slots__ = ('calls', 'reads', 'writes', 'bytes', 'seconds')
+
+    def __init__(self):
+        self.calls = self.reads = self.writes = self.bytes = 0
+        self.seconds = 0.0
+
+def estimate_document_size(value):
+    """Approximates Firestore's stored size of a value (strings, numbers, maps and arrays)."""
+    if isinstance(value, dict):
+        return sum(len(str(k)) + 1 + estimate_document_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_document_size(v) for v in value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if value is None or isinstance(value, bool):
+        return 1
+    return 8
+
+def record_firestore_call(reads=0, writes=0, nbytes=0, seconds=0.0):
+    stats = g.get('firestore_stats') if has_app_context() else None
+    if stats is not None:
+        stats.calls += 1
+        stats.reads += reads
+        stats.writes += writes
+        stats.bytes += nbytes
+        stats.seconds += seconds
+
+def _unwrap(value):
+    if isinstance(value, InstrumentedFirestore):
+        return object.__getattribute__(value, '_target')
+    if isinstance(value, (list, tuple)):
+        return type(value)(_unwrap(v) for v in value)
+    return value
+
+def _snapshot_size(snapshot):
+    # DocumentSnapshot.to_dict() deep-copies; the decoded fields are already held on _data.
+    return estimate_document_size(getattr(snapshot, '_data', None) or {})
+
+def _counted_stream(results, elapsed):
+    reads = nbytes = 0
+    try:
+        while True:
+            resumed = time.perf_counter()
+            try:
+                snapshot = next(results)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - resumed
+            reads += 1
+            nbytes += _snapshot_size(snapshot)
+            yield snapshot
+    finally:
+        record_firestore_call(reads=max(reads, 1), nbytes=nbytes, seconds=elapsed)
+
+class InstrumentedFirestore:
+    """Transparent proxy over the Firestore client that accounts each RPC to the current request.
+
+    Chainable objects (collections, documents, queries, batches, transactions) are
+    proxied in turn, so `db.collection(...).document(...).get()` is counted without
+    call sites having to know about it.
+    """
+
+    def __init__(self, target):
+        object.__setattr__(self, '_target', target)
+
+    @property
+    def __class__(self):
+        # Keeps isinstance() checks inside google-cloud-firestore working on proxies.
+        return type(object.__getattribute__(self, '_target'))
+
+    def __setattr__(self, name, value):
+        setattr(object.__getattribute__(self, '_target'), name, value)
+
+    def __getattr__(self, name):
+        attr = getattr(object.__getattribute__(self, '_target'), name)
+        if not callable(attr):
+            return attr
+        if name in FIRESTORE_READ_METHODS:
+            return self._read(attr)
+        if name in FIRESTORE_WRITE_METHODS:
+            return self._write(attr)
+        if name == 'commit':
+            return self._write(attr, documents=0)
+
+        @wraps(attr)
+        def chained(*args, **kwargs):
+            result = attr(*_unwrap(args), **{k: _unwrap(v) for k, v in kwargs.items()})
+            if type(result).__name__ in FIRESTORE_PROXIED_TYPES:
+                return InstrumentedFirestore(result)
+            return result
+        return chained
+
+    def __eq__(self, other):
+        return object.__getattribute__(self, '_target') == _unwrap(other)
+
+    def __hash__(self):
+        return hash(object.__getattribute__(self, '_target'))
+
+    def __repr__(self):
+        return f"<InstrumentedFirestore {object.__getattribute__(self, '_target')!r}>"
+
+    @staticmethod
+    def _read(method):
+        @wraps(method)
+        def read(*args, **kwargs):
+            started = time.perf_counter()
+            result = method(*_unwrap(args), **{k: _unwrap(v) for k, v in kwargs.items()})
+            elapsed = time.perf_counter() - started
+            if hasattr(result, '__next__'):
+                return _counted_stream(result, elapsed)
+            if isinstance(result, list):
+                snapshots = [r for r in result if hasattr(r, 'exists')]
+                nbytes = sum(_snapshot_size(s) for s in snapshots)
+                record_firestore_call(reads=max(len(snapshots), 1), nbytes=nbytes, seconds=elapsed)
+            else:
+                record_firestore_call(reads=1, nbytes=_snapshot_size(result), seconds=elapsed)
+            return result
+        return read
+
+    @staticmethod
+    def _write(method, documents=1):
+        @wraps(method)
+        def write(*args, **kwargs):
+            started = time.perf_counter()
+            args, kwargs = _unwrap(args), {k: _unwrap(v) for k, v in kwargs.items()}
+            result = method(*args, **kwargs)
+            nbytes = sum(estimate_document_size(a) for a in args if isinstance(a, dict))
+            record_firestore_call(writes=documents, nbytes=nbytes, seconds=time.perf_counter() - started)
+            return result
+        return write
 
+# --- Firebase Initialization ---
 db = None
-if FIREBASE_AVAILABLE:
+_db_ready = False
+_db_lock = threading.Lock()
+
+def import_firebase_sdk():
+    """Imports the Firebase SDK and binds the names the app uses from it."""
+    global firebase_admin, credentials, firestore, firestore_async, AlreadyExists
+    global FIRESTORE_ASYNC_AVAILABLE, TRANSIENT_STORAGE_ERRORS
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    from google.api_core.exceptions import (
+        AlreadyExists, Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable,
+    )
+    TRANSIENT_STORAGE_ERRORS = (TimeoutError, ConnectionError, Aborted, DeadlineExceeded, InternalServerError,
+                                ResourceExhausted, ServiceUnavailable)
     try:
-        required_env_vars = ['FIREBASE_PROJECT_ID', 'FIREBASE_PRIVATE_KEY', 'FIREBASE_CLIENT_EMAIL']
-        if all(os.getenv(key) for key in required_env_vars):
+        from firebase_admin import firestore_async
+        FIRESTORE_ASYNC_AVAILABLE = True
+    except ImportError:
+        FIRESTORE_ASYNC_AVAILABLE = False
+
+FIREBASE_ENV_VARS = ['FIREBASE_PROJECT_ID', 'FIREBASE_PRIVATE_KEY', 'FIREBASE_CLIENT_EMAIL']
+
+def firebase_configured():
+    """Whether credentials are present, i.e. the app isn't meant to run in offline mode. Doesn't connect."""
+    return FIREBASE_AVAILABLE and (all(os.getenv(key) for key in FIREBASE_ENV_VARS) or os.path.exists('firebase-key.json'))
+
+def connect_firestore():
+    """Loads credentials and creates the Firestore client; returns None in offline mode."""
+    global FIREBASE_AVAILABLE
+    if not FIREBASE_AVAILABLE:
+        print("⚠️ Firebase library not found. Running in offline mode.")
+        return None
+    try:
+        import_firebase_sdk()
+        if all(os.getenv(key) for key in FIREBASE_ENV_VARS):
             print("Attempting to initialize Firebase with environment variables...")
             private_key = os.getenv('FIREBASE_PRIVATE_KEY').replace('\\n', '\n')
             firebase_config = {
@@ -51,14 +269,82 @@ if FIREBASE_AVAILABLE:
         if not firebase_admin._apps:
             firebase_admin.initialize_app(cred)
         
-        db = firestore.client()
+        client = InstrumentedFirestore(firestore.client())
         print("✅ Firebase initialized successfully")
+        return client
     except Exception as e:
         print(f"❌ Firebase init error: {e}")
-        db = None
         FIREBASE_AVAILABLE = False
-else:
-    print("⚠️ Firebase library not found. Running in offline mode.")
+        return None
+
+def get_db():
+    """Returns the Firestore client, connecting on first use. Safe to call from any thread."""
+    global db, _db_ready
+    if not _db_ready:
+        with _db_lock:
+            if not _db_ready:
+                db = connect_firestore()
+                _db_ready = True
+    return db
+
+def reconnect_firestore():
+    """Gives this process its own Firestore client.
+
+    gRPC channels don't survive fork(), so when gunicorn preloads the app every worker
+    calls this from post_fork instead of reusing the client the parent created.
+    """
+    global db
+    if not _db_ready or db is None:
+        return # never connected in the parent; the worker connects on first use
+    from google.cloud import firestore as gcloud_firestore
+    firebase_app = firebase_admin.get_app()
+    db = InstrumentedFirestore(gcloud_firestore.Client(
+        project=firebase_app.project_id,
+        credentials=firebase_app.credential.get_credential(),
+    ))
+
+# --- JSON Response Helper ---
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 5))
+
+def dumps_json(payload):
+    """Serializes payload to UTF-8 JSON bytes, using orjson when it is installed."""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass # e.g. integers wider than 64 bits; the stdlib encoder handles them
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def negotiate_encoding():
+    offered = ['br', 'gzip'] if BROTLI_AVAILABLE else ['gzip']
+    return request.accept_encodings.best_match(offered)
+
+def json_response(payload, status=200, etag=False):
+    """Builds every JSON API response: fast serialization plus negotiated compression.
+
+    With etag=True the response carries a content hash the client can revalidate
+    with If-None-Match, getting an empty 304 when nothing changed.
+    """
+    body = dumps_json(payload)
+    headers = {'Vary': 'Accept-Encoding'}
+    if etag:
+        # Weak, because the same JSON goes out under different content encodings.
+        tag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        headers['ETag'] = f'W/"{tag}"'
+        headers['Cache-Control'] = 'private, no-cache'
+        if request.if_none_match.contains_weak(tag):
+            return Response(status=304, headers=headers)
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        encoding = negotiate_encoding()
+        if encoding == 'br':
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+    return Response(body, status=status, mimetype='application/json', headers=headers)
 
 # --- Login Decorator ---
 def login_required(f):
@@ -66,8 +352,8 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return jsonify({'error': 'Unauthorized', 'success': False}), 401
-            return redirect(url_for('login'))
+                return json_response({'error': 'Unauthorized', 'success': False}, 401)
+            return redirect(url_for('.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -76,21 +362,407 @@ def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
-            return jsonify({'error': 'Unauthorized', 'success': False}), 401
+            return json_response({'error': 'Unauthorized', 'success': False}, 401)
         
         role = session.get('role')
         if role != 'admin':
-            return jsonify({'error': 'Forbidden', 'success': False}), 403
+            return json_response({'error': 'Forbidden', 'success': False}, 403)
             
         return f(*args, **kwargs)
     return decorated_function
 
+# --- Request Metrics ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RouteMetrics:
+    """Per-route latency histogram and Firestore totals, aggregated for this worker process."""
+    __slots__ = ('count', 'seconds', 'buckets', 'firestore_calls', 'firestore_reads',
+                 'firestore_writes', 'firestore_bytes', 'firestore_seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.firestore_calls = self.firestore_reads = self.firestore_writes = self.firestore_bytes = 0
+        self.firestore_seconds = 0.0
+
+    def observe(self, seconds, stats):
+        self.count += 1
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.firestore_calls += stats.calls
+        self.firestore_reads += stats.reads
+        self.firestore_writes += stats.writes
+        self.firestore_bytes += stats.bytes
+        self.firestore_seconds += stats.seconds
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'seconds_sum': round(self.seconds, 6),
+            'buckets': {str(bound): n for bound, n in zip(LATENCY_BUCKETS, self.buckets)},
+            'firestore': {
+                'calls': self.firestore_calls,
+                'reads': self.firestore_reads,
+                'writes': self.firestore_writes,
+                'bytes': self.firestore_bytes,
+                'seconds_sum': round(self.firestore_seconds, 6),
+            },
+        }
+
+route_metrics = defaultdict(RouteMetrics)
+route_metrics_lock = threading.Lock()
+
+# --- Structured Request Log ---
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 500))
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', 0.01))
+
+request_log = logging.getLogger('coin_tracker.requests')
+if not request_log.handlers:
+    _request_log_handler = logging.StreamHandler()
+    _request_log_handler.setFormatter(logging.Formatter('%(message)s'))
+    request_log.addHandler(_request_log_handler)
+    request_log.setLevel(logging.INFO)
+    request_log.propagate = False
+
+def hash_user_id(user_id):
+    if not user_id:
+        return None
+    return hashlib.sha256(f'{current_app.secret_key}:{user_id}'.encode('utf-8')).hexdigest()[:16]
+
+def log_request(response, elapsed, stats):
+    """Writes one JSON line for every slow request plus a random sample of the rest."""
+    duration_ms = elapsed * 1000
+    if duration_ms >= SLOW_REQUEST_MS:
+        reason = 'slow'
+    elif REQUEST_LOG_SAMPLE_RATE > 0 and random.random() < REQUEST_LOG_SAMPLE_RATE:
+        reason = 'sample'
+    else:
+        return
+
+    request_log.info(json.dumps({
+        'ts': dt_now_iso(),
+        'reason': reason,
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else 'unmatched',
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 1),
+        'user': hash_user_id(session.get('user_id')),
+        'profile': session.get('current_profile'),
+        'txn_count': g.get('txn_count'),
+        'request_bytes': request.content_length or 0,
+        'response_bytes': response.content_length,
+        'firestore_calls': stats.calls,
+        'firestore_reads': stats.reads,
+        'firestore_writes': stats.writes,
+        'firestore_bytes': stats.bytes,
+        'firestore_ms': round(stats.seconds * 1000, 1),
+    }, separators=(',', ':')))
+
+def traced(span_name):
+    """Records the time spent in a function under span_name for the current request."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                if has_app_context() and 'spans' in g:
+                    g.spans[span_name] += time.perf_counter() - started
+        return decorated_function
+    return decorator
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.firestore_stats = FirestoreStats()
+    g.spans = defaultdict(float)
+
+@bp.after_app_request
+def finish_request_metrics(response):
+    if 'request_started' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_started
+    stats = g.firestore_stats
+
+    timings = [
+        f'total;dur={elapsed * 1000:.1f}',
+        f'firestore;dur={stats.seconds * 1000:.1f};desc="{stats.reads} reads, {stats.writes} writes, {stats.bytes} bytes"',
+        f'app;dur={max(elapsed - stats.seconds, 0) * 1000:.1f}',
+    ]
+    timings.extend(f'{name};dur={seconds * 1000:.1f}' for name, seconds in g.spans.items())
+    response.headers['Server-Timing'] = ', '.join(timings)
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    with route_metrics_lock:
+        route_metrics[(request.method, route)].observe(elapsed, stats)
+    log_request(response, elapsed, stats)
+    return response
+
+# --- On-Demand Profiling ---
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', 50))
+PROFILE_TOP_FUNCTIONS = 25
+PROFILE_TOP_ALLOCATIONS = 10
+
+profile_reports = deque(maxlen=PROFILE_BUFFER_SIZE)
+# One profiled request at a time per process: tracemalloc is process-wide.
+profiling_lock = threading.Lock()
+
+def profile_trigger():
+    if request.args.get('__profile') == '1' and session.get('role') == 'admin':
+        return 'admin'
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+@bp.before_app_request
+def start_profiling():
+    trigger = profile_trigger()
+    if trigger is None or not profiling_lock.acquire(blocking=False):
+        return
+    g.profile_trigger = trigger
+    g.profile_started = time.perf_counter()
+    g.profile_cpu_started = time.process_time()
+    tracemalloc.start()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+@bp.after_app_request
+def tag_profiled_response(response):
+    if 'profiler' in g:
+        g.profile_status = response.status_code
+        g.profile_id = str(uuid.uuid4())
+        response.headers['X-Profile-Id'] = g.profile_id
+    return response
+
+@bp.teardown_app_request
+def finish_profiling(exc):
+    if g.get('in_subrequest'):
+        return # the profile covers the whole batch
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        wall = time.perf_counter() - g.profile_started
+        cpu = time.process_time() - g.profile_cpu_started
+        _, peak = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]
+    finally:
+        tracemalloc.stop()
+        profiling_lock.release()
+
+    functions = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][3], reverse=True)
+    stats = g.get('firestore_stats') or FirestoreStats()
+    profile_reports.append({
+        'id': g.get('profile_id', str(uuid.uuid4())),
+        'at': dt_now_iso(),
+        'trigger': g.profile_trigger,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'status': g.get('profile_status', 500),
+        'user_id': session.get('user_id'),
+        'wall_ms': round(wall * 1000, 2),
+        'cpu_ms': round(cpu * 1000, 2),
+        'peak_alloc_kb': round(peak / 1024, 1),
+        'firestore': {'calls': stats.calls, 'reads': stats.reads, 'writes': stats.writes,
+                      'seconds': round(stats.seconds, 4)},
+        'top_functions': [
+            {
+                'function': f'{"/".join(filename.replace(os.sep, "/").split("/")[-2:])}:{line}({name})',
+                'calls': calls,
+                'tottime_ms': round(tottime * 1000, 3),
+                'cumtime_ms': round(cumtime * 1000, 3),
+            }
+            for (filename, line, name), (_, calls, tottime, cumtime, _) in functions[:PROFILE_TOP_FUNCTIONS]
+        ],
+        'top_allocations': [
+            {'location': str(stat.traceback[0]), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+            for stat in allocations
+        ],
+        'error': repr(exc) if exc else None,
+    })
+
+def render_prometheus_metrics():
+    lines = [
+        '# HELP coin_tracker_request_duration_seconds Request latency by route.',
+        '# TYPE coin_tracker_request_duration_seconds histogram',
+    ]
+    with route_metrics_lock:
+        snapshot = {key: metrics.to_dict() for key, metrics in route_metrics.items()}
+
+    for (method, route), m in sorted(snapshot.items()):
+        labels = f'method="{method}",route="{route}"'
+        for bound, n in m['buckets'].items():
+            lines.append(f'coin_tracker_request_duration_seconds_bucket{{{labels},le="{bound}"}} {n}')
+        lines.append(f'coin_tracker_request_duration_seconds_bucket{{{labels},le="+Inf"}} {m["count"]}')
+        lines.append(f'coin_tracker_request_duration_seconds_sum{{{labels}}} {m["seconds_sum"]}')
+        lines.append(f'coin_tracker_request_duration_seconds_count{{{labels}}} {m["count"]}')
+
+    for field, kind, help_text in (
+        ('calls', 'counter', 'Firestore RPCs issued.'),
+        ('reads', 'counter', 'Firestore documents read.'),
+        ('writes', 'counter', 'Firestore documents written.'),
+        ('bytes', 'counter', 'Approximate Firestore document bytes transferred.'),
+        ('seconds_sum', 'counter', 'Time spent waiting on Firestore.'),
+    ):
+        name = f'coin_tracker_firestore_{field.replace("_sum", "")}_total'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (method, route), m in sorted(snapshot.items()):
+            lines.append(f'{name}{{method="{method}",route="{route}"}} {m["firestore"][field]}')
+
+    lines.append('# HELP coin_tracker_storage_breaker_open Whether the Firestore circuit breaker is failing calls fast.')
+    lines.append('# TYPE coin_tracker_storage_breaker_open gauge')
+    lines.append(f'coin_tracker_storage_breaker_open {int(storage_breaker.state != "closed")}')
+    return '\n'.join(lines) + '\n'
+
+# --- Rate Limiting ---
+# Token buckets per route class, "capacity/seconds": a client may burst `capacity`
+# requests, then gets one more every seconds/capacity. Signed-in requests are keyed
+# by user id, anonymous ones (and auth attempts, which target other accounts) by IP.
+RATE_LIMIT_DEFAULTS = {
+    'reads': '120/60',
+    'writes': '60/60',
+    'auth': '10/60',
+    'admin': '120/60',
+}
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1))
+
+def parse_rate_limit(spec):
+    """Parses "capacity/seconds" into (capacity, tokens per second); "off" disables the class."""
+    if spec.strip().lower() in ('', '0', 'off'):
+        return None
+    capacity, seconds = spec.split('/')
+    return int(capacity), int(capacity) / float(seconds)
+
+RATE_LIMITS = {
+    name: parse_rate_limit(os.environ.get(f'RATE_LIMIT_{name.upper()}', default))
+    for name, default in RATE_LIMIT_DEFAULTS.items()
+}
+
+class MemoryTokenBuckets:
+    """Per-process buckets; each gunicorn worker enforces the limit on its own share of traffic.
+
+    Kept in least-recently-used order and capped at MAX_KEYS, so a flood of new keys (e.g.
+    spoofed IPs) evicts the stalest clients instead of growing the map.
+    """
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """Takes one token; returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.MAX_KEYS:
+                self.buckets.popitem(last=False)
+        return 0 if allowed else (1 - tokens) / rate
+
+class RedisTokenBuckets:
+    """Buckets shared by every worker and instance through Redis, updated atomically by a script."""
+
+    SCRIPT = """
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    local capacity, rate = tonumber(ARGV[1]), tonumber(ARGV[2])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local wait = 0
+    if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, socket_timeout=0.1)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate):
+        return float(self.script(keys=[f'ratelimit:{key}'], args=[capacity, rate]))
+
+rate_limit_store = MemoryTokenBuckets()
+if os.environ.get('REDIS_URL'):
+    if REDIS_AVAILABLE:
+        rate_limit_store = RedisTokenBuckets(os.environ['REDIS_URL'])
+    else:
+        print("⚠️ REDIS_URL is set but the redis package is not installed; rate limits are per process.")
+
+def client_ip():
+    """The client address as seen by the closest of TRUSTED_PROXIES proxies (Render adds one)."""
+    forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+    if TRUSTED_PROXIES and len(forwarded) >= TRUSTED_PROXIES:
+        return forwarded[-TRUSTED_PROXIES]
+    return request.remote_addr
+
+def rate_limit_class():
+    if not request.path.startswith('/api/'):
+        return None
+    if request.endpoint == f'{bp.name}.batch_requests':
+        return None # each sub-request is charged instead
+    if request.path.startswith('/api/admin/'):
+        return 'admin'
+    if request.endpoint in (f'{bp.name}.handle_login', f'{bp.name}.register'):
+        return 'auth'
+    return 'reads' if request.method in ('GET', 'HEAD') else 'writes'
+
+@bp.before_app_request
+def enforce_rate_limit():
+    route_class = rate_limit_class()
+    limit = RATE_LIMITS.get(route_class)
+    if limit is None:
+        return None
+    user_id = session.get('user_id') if route_class != 'auth' else None
+    key = f'{route_class}:user:{user_id}' if user_id else f'{route_class}:ip:{client_ip()}'
+    try:
+        wait = rate_limit_store.take(key, *limit)
+    except Exception as e:
+        # A rate limiter outage must not take the app down with it.
+        print(f"Rate limit store error: {e}")
+        return None
+    if wait <= 0:
+        return None
+    response = json_response({'success': False, 'error': 'Too many requests, please slow down'}, 429)
+    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+    return response
+
 # --- Date Helper ---
 def dt_now_iso():
     return datetime.now(timezone.utc).isoformat()
 
+def transaction_date(t):
+    """Returns the calendar date of a transaction, or None if it has no usable date."""
+    try:
+        return datetime.fromisoformat(t.get('date', '').replace('Z', '+00:00')).date()
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def filter_date(value):
+    """Parses a history date filter, or returns None if it is missing or unusable."""
+    try:
+        return datetime.fromisoformat(value).date() if value else None
+    except (ValueError, TypeError):
+        return None
+
 # --- Achievement Calculation Function ---
-def calculate_achievements(transactions, balance, goal):
+def calculate_achievements(transactions, balance, goal, archived=None):
+    """archived is the archive_summary() of the profile's archived transactions, if any."""
     achievements = []
     today = datetime.now(timezone.utc).date()
 
@@ -160,13 +832,18 @@ def calculate_achievements(transactions, balance, goal):
             if t.get('amount', 0) < 0:
                 last_spend_date = datetime.fromisoformat(t['date'].replace('Z', '+00:00')).date()
                 break
+        if last_spend_date is None and archived and archived['last_spend']:
+            last_spend_date = date.fromisoformat(archived['last_spend'])
         
         no_spend_days = 0
         if last_spend_date:
             no_spend_days = (today - last_spend_date).days
         else:
             # Never spent? That's a full streak!
-            if sorted_tx: # Check if there are any transactions at all
+            if archived and archived['first_date']:
+                first_tx_date = date.fromisoformat(archived['first_date'])
+                no_spend_days = (today - first_tx_date).days
+            elif sorted_tx: # Check if there are any transactions at all
                  first_tx_date = datetime.fromisoformat(sorted_tx[0]['date'].replace('Z', '+00:00')).date()
                  no_spend_days = (today - first_tx_date).days
             
@@ -183,13 +860,1132 @@ def calculate_achievements(transactions, balance, goal):
 # --- END NEW FUNCTION ---
 
 
+# --- Admin Stats Counters ---
+# Totals are spread over STATS_SHARDS documents so concurrent writers don't contend
+# on one counter document; reads sum the shards.
+STATS_SHARDS = int(os.environ.get('STATS_SHARDS', 10))
+SIGNUP_CHART_DAYS = 30
+
+def profile_totals(profile_data):
+    """Returns (transaction count, coin total) for one profile; archived coins are in its carry-forward entry."""
+    txns = profile_data.get('transactions', [])
+    return sum(1 for t in txns if not is_archive_carry(t)), sum(t.get('amount', 0) for t in txns)
+
+def user_data_totals(doc_data):
+    """Returns (transaction count, coin total) across all of a user's profiles, archived transactions included."""
+    if not doc_data:
+        return 0, 0
+    if doc_data.get('profiles'):
+        totals = [profile_totals(p) for p in doc_data['profiles'].values()]
+    elif 'transactions' in doc_data:
+        totals = [profile_totals(doc_data)]
+    else:
+        return 0, 0
+    archived = sum(c.get('count', 0) for entry in (doc_data.get('transaction_archive') or {}).values()
+                   for c in entry.get('chunks', []))
+    return sum(n for n, _ in totals) + archived, sum(c for _, c in totals)
+
+def signup_day(created_at):
+    """Returns the UTC day (YYYY-MM-DD) of a stored created_at timestamp, or None."""
+    try:
+        created = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return created.astimezone(timezone.utc).strftime('%Y-%m-%d')
+
+def user_data_last_updated(doc_data):
+    """Returns the most recent profile last_updated timestamp, or None."""
+    stamps = [p.get('last_updated') for p in (doc_data or {}).get('profiles', {}).values() if p.get('last_updated')]
+    return max(stamps) if stamps else None
+
+class BatchWriter:
+    """Queues writes and commits them in chunks below Firestore's 500-writes-per-batch limit."""
+
+    def __init__(self, chunk_size=400):
+        self.chunk_size = chunk_size
+        self.batch = get_db().batch()
+        self.pending = 0
+        self.committed = 0
+
+    def set(self, ref, data, merge=False):
+        self.batch.set(ref, data, merge=merge)
+        self._queued()
+
+    def delete(self, ref):
+        self.batch.delete(ref)
+        self._queued()
+
+    def _queued(self):
+        self.pending += 1
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.batch.commit()
+            self.committed += self.pending
+            self.batch = get_db().batch()
+            self.pending = 0
+
+def record_stats_delta(batch, users=0, transactions=0, coins=0, signup_day=None, signups=0):
+    """Adds counter increments to a pending write batch so they commit atomically with the change."""
+    deltas = {k: firestore.Increment(v) for k, v in
+              (('users', users), ('transactions', transactions), ('coins', coins)) if v}
+    if deltas:
+        shard = get_db().collection('stats_shards').document(str(random.randrange(STATS_SHARDS)))
+        batch.set(shard, deltas, merge=True)
+    if signup_day and signups:
+        batch.set(get_db().collection('stats_daily').document(signup_day),
+                  {'signups': firestore.Increment(signups)}, merge=True)
+
+def read_admin_counters():
+    """Sums the counter shards, or returns None if they have never been reconciled."""
+    totals = {'users': 0, 'transactions': 0, 'coins': 0}
+    reconciled = False
+    for shard in get_db().collection('stats_shards').stream():
+        data = shard.to_dict() or {}
+        reconciled = reconciled or 'reconciled_at' in data
+        for key in totals:
+            totals[key] += data.get(key, 0)
+    return totals if reconciled else None
+
+def signup_chart_days(days=SIGNUP_CHART_DAYS):
+    today = datetime.now(timezone.utc)
+    return [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in reversed(range(days))]
+
+def read_signup_chart():
+    labels = signup_chart_days()
+    refs = [get_db().collection('stats_daily').document(day) for day in labels]
+    counts = {snap.id: (snap.to_dict() or {}).get('signups', 0) for snap in get_db().get_all(refs) if snap.exists}
+    return {'labels': labels, 'data': [counts.get(day, 0) for day in labels]}
+
+def count_documents(query):
+    """Counts the documents matching query with a server-side aggregation when the client supports it."""
+    try:
+        aggregation = query.count(alias='total')
+    except AttributeError:
+        # Older google-cloud-firestore: ship document names only, not their fields.
+        return sum(1 for _ in query.select(['__name__']).stream())
+    return int(aggregation.get()[0][0].value)
+
+def count_signups(day):
+    next_day = (datetime.fromisoformat(day) + timedelta(days=1)).strftime('%Y-%m-%d')
+    # created_at is stored as a UTC ISO string, so a day is a lexicographic range.
+    return count_documents(get_db().collection('users').where('created_at', '>=', day).where('created_at', '<', next_day))
+
+def rebuild_user_summaries():
+    """Rewrites every user_summaries record from users and user_data; returns (transactions, coins)."""
+    summaries = {}
+    for user in get_db().collection('users').select(['username', 'username_lower', 'created_at']).stream():
+        user_data = user.to_dict() or {}
+        summaries[user.id] = {
+            'username': user_data.get('username', 'N/A'),
+            'username_lower': user_data.get('username_lower', ''),
+            'created_at': user_data.get('created_at'),
+            'balance': 0,
+            'txn_count': 0,
+            'last_updated': None,
+        }
+
+    transactions = coins = 0
+    for user_data_doc in get_db().collection('user_data').stream():
+        doc_data = user_data_doc.to_dict()
+        user_transactions, user_coins = user_data_totals(doc_data)
+        transactions += user_transactions
+        coins += user_coins
+        if user_data_doc.id in summaries:
+            summaries[user_data_doc.id].update({
+                'balance': user_coins,
+                'txn_count': user_transactions,
+                'last_updated': user_data_last_updated(doc_data),
+            })
+
+    writer = BatchWriter()
+    summaries_ref = get_db().collection('user_summaries')
+    for stale in summaries_ref.select(['__name__']).stream():
+        if stale.id not in summaries:
+            writer.delete(summaries_ref.document(stale.id))
+    for user_id, summary in summaries.items():
+        writer.set(summaries_ref.document(user_id), summary)
+    writer.flush()
+    return transactions, coins
+
+def reconcile_admin_stats():
+    """Recomputes every admin counter and user summary from the source collections. Safe to re-run."""
+    users = count_documents(get_db().collection('users'))
+    signups = {day: count_signups(day) for day in signup_chart_days()}
+    transactions, coins = rebuild_user_summaries()
+
+    # Increments landing between the scan and this commit are overwritten; the next
+    # reconciliation picks them up again.
+    batch = get_db().batch()
+    for shard in range(STATS_SHARDS):
+        values = {'users': 0, 'transactions': 0, 'coins': 0}
+        if shard == 0:
+            values = {'users': users, 'transactions': transactions, 'coins': coins, 'reconciled_at': dt_now_iso()}
+        batch.set(get_db().collection('stats_shards').document(str(shard)), values)
+    for day in signup_chart_days():
+        batch.set(get_db().collection('stats_daily').document(day), {'signups': signups[day]})
+    batch.commit()
+    backfill_username_reservations()
+    return {'users': users, 'transactions': transactions, 'coins': coins}
+
+@bp.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Recomputes the admin dashboard counters and user summaries from scratch."""
+    print(reconcile_admin_stats())
+
+# --- Username Reservations ---
+# usernames/{username_lower} -> {'user_id', 'username'} is created in the same
+# transaction as the account, so a name can only ever be claimed once and login
+# resolves a username with a direct document get instead of a query.
+_usernames_backfilled = False
+
+def usernames_backfilled():
+    """True once every pre-existing account has a reservation. Cached for the process after that."""
+    global _usernames_backfilled
+    if not _usernames_backfilled:
+        marker = get_db().collection('app_config').document('usernames_index').get()
+        _usernames_backfilled = marker.exists and bool((marker.to_dict() or {}).get('backfilled_at'))
+    return _usernames_backfilled
+
+def reserve_username(username, user_id):
+    """Claims a legacy account's name outside registration; returns False if already taken."""
+    try:
+        get_db().collection('usernames').document(username.lower()).create({'user_id': user_id, 'username': username})
+        return True
+    except AlreadyExists:
+        return False
+
+def find_user_by_username(username):
+    """Returns the users document snapshot for a username, or None."""
+    username_lower = username.lower()
+    reservation = get_db().collection('usernames').document(username_lower).get()
+    if reservation.exists:
+        user_doc = get_db().collection('users').document(reservation.to_dict()['user_id']).get()
+        return user_doc if user_doc.exists else None
+    if usernames_backfilled():
+        return None
+
+    # Account created before the index existed: fall back to the query and reserve it now.
+    matches = get_db().collection('users').where('username_lower', '==', username_lower).limit(1).get()
+    if not matches:
+        return None
+    reserve_username(matches[0].to_dict().get('username', username), matches[0].id)
+    return matches[0]
+
+def create_user_account(username, password_hash):
+    """Creates the user, its reservation, summary and counters atomically; returns the new id or None if taken."""
+    username_lower = username.lower()
+    user_id = str(uuid.uuid4())
+    created_at = dt_now_iso()
+    check_legacy = not usernames_backfilled()
+    reservation_ref = get_db().collection('usernames').document(username_lower)
+    users_ref = get_db().collection('users')
+
+    def create(transaction):
+        if reservation_ref.get(transaction=transaction).exists:
+            return None
+        if check_legacy and list(transaction.get(users_ref.where('username_lower', '==', username_lower).limit(1))):
+            return None
+        transaction.create(reservation_ref, {'user_id': user_id, 'username': username})
+        transaction.set(users_ref.document(user_id), {
+            'username': username,
+            'username_lower': username_lower,
+            'password_hash': password_hash,
+            'created_at': created_at,
+            'role': 'user'
+        })
+        transaction.set(get_db().collection('user_summaries').document(user_id), {
+            'username': username,
+            'username_lower': username_lower,
+            'created_at': created_at,
+            'balance': 0,
+            'txn_count': 0,
+            'last_updated': None,
+        })
+        record_stats_delta(transaction, users=1, signup_day=signup_day(created_at), signups=1)
+        return user_id
+
+    return firestore.transactional(create)(get_db().transaction())
+
+def backfill_username_reservations():
+    """Reserves every account's name, drops reservations of deleted accounts and marks the index complete.
+
+    If legacy data holds the same name twice, the earliest account keeps it.
+    """
+    # Reservations are read before users: registration writes both atomically, so every
+    # reservation seen here has its account visible to the scan below.
+    usernames_ref = get_db().collection('usernames')
+    reservations = {r.id: (r.to_dict() or {}).get('user_id') for r in usernames_ref.stream()}
+
+    owners = {}
+    users = get_db().collection('users').select(['username', 'username_lower', 'created_at']).stream()
+    for user in sorted(users, key=lambda u: (u.to_dict() or {}).get('created_at') or ''):
+        user_data = user.to_dict() or {}
+        username_lower = user_data.get('username_lower') or user_data.get('username', '').lower()
+        if username_lower and username_lower not in owners:
+            owners[username_lower] = (user.id, user_data.get('username', username_lower))
+
+    writer = BatchWriter()
+    created = 0
+    for username_lower in reservations.keys() - owners.keys():
+        writer.delete(usernames_ref.document(username_lower))
+    for username_lower, (user_id, username) in owners.items():
+        if reservations.get(username_lower) != user_id:
+            writer.set(usernames_ref.document(username_lower), {'user_id': user_id, 'username': username})
+            created += 1
+    writer.flush()
+
+    get_db().collection('app_config').document('usernames_index').set({'backfilled_at': dt_now_iso(), 'count': len(owners)})
+    return created
+
+@bp.cli.command('backfill-usernames')
+def backfill_usernames_command():
+    """Creates username reservations for accounts registered before the index existed."""
+    print(f"Reserved {backfill_username_reservations()} username(s).")
+
+# --- Admin Dashboard Snapshots ---
+ADMIN_SNAPSHOT_INTERVAL = int(os.environ.get('ADMIN_SNAPSHOT_INTERVAL', 300))
+ADMIN_TOP_BALANCES = 10
+ACTIVITY_WINDOWS_DAYS = (1, 7, 30, 90)
+TXN_COUNT_BUCKETS = (('0', 0, 1), ('1-9', 1, 10), ('10-99', 10, 100), ('100-999', 100, 1000), ('1000+', 1000, None))
+
+def compute_admin_snapshot():
+    """Runs every expensive admin dashboard query once and returns the results."""
+    counters = read_admin_counters()
+    if counters is None:
+        counters = reconcile_admin_stats()
+
+    summaries_ref = get_db().collection('user_summaries')
+    top_balances = [
+        {'user_id': doc.id, 'username': (doc.to_dict() or {}).get('username', 'N/A'),
+         'balance': (doc.to_dict() or {}).get('balance', 0)}
+        for doc in summaries_ref.select(['username', 'balance'])
+                                .order_by('balance', direction=firestore.Query.DESCENDING)
+                                .limit(ADMIN_TOP_BALANCES).stream()
+    ]
+
+    now = datetime.now(timezone.utc)
+    active_users = {
+        f'{days}d': count_documents(summaries_ref.where('last_updated', '>=', (now - timedelta(days=days)).isoformat()))
+        for days in ACTIVITY_WINDOWS_DAYS
+    }
+    txn_counts = {}
+    for label, low, high in TXN_COUNT_BUCKETS:
+        query = summaries_ref.where('txn_count', '>=', low)
+        if high is not None:
+            query = query.where('txn_count', '<', high)
+        txn_counts[label] = count_documents(query)
+
+    return {
+        'stats': {
+            'total_users': counters['users'],
+            'total_coins': counters['coins'],
+            'total_transactions': counters['transactions']
+        },
+        'chart_data': read_signup_chart(),
+        'top_balances': top_balances,
+        'activity': {'active_users': active_users, 'txn_count_histogram': txn_counts},
+    }
+
+def store_admin_snapshot():
+    snapshot = {'data': compute_admin_snapshot(), 'generated_at': dt_now_iso()}
+    get_db().collection('app_config').document('admin_snapshot').set(snapshot)
+    return snapshot
+
+def load_admin_snapshot():
+    doc = get_db().collection('app_config').document('admin_snapshot').get()
+    return doc.to_dict() if doc.exists else None
+
+def snapshot_age_seconds(snapshot):
+    generated_at = datetime.fromisoformat(snapshot['generated_at'])
+    return (datetime.now(timezone.utc) - generated_at).total_seconds()
+
+def refresh_admin_snapshot_if_stale():
+    """Recomputes the snapshot unless another worker already did so within the interval."""
+    snapshot = load_admin_snapshot()
+    if snapshot is None or snapshot_age_seconds(snapshot) >= ADMIN_SNAPSHOT_INTERVAL:
+        snapshot = store_admin_snapshot()
+    return snapshot
+
+class AdminSnapshotScheduler:
+    """Refreshes the admin snapshot every ADMIN_SNAPSHOT_INTERVAL seconds on a daemon thread.
+
+    Started lazily from the first request so it runs in each worker after any fork.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='admin-snapshots', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        # Spread workers out so they don't all check the snapshot at the same moment.
+        delay = random.uniform(0, self.interval / 10)
+        while not self._stopped.wait(delay):
+            try:
+                refresh_admin_snapshot_if_stale()
+            except Exception as e:
+                print(f"Admin snapshot refresh error: {e}")
+            delay = self.interval
+
+admin_snapshot_scheduler = AdminSnapshotScheduler(ADMIN_SNAPSHOT_INTERVAL)
+
+@bp.before_app_request
+def start_admin_snapshot_scheduler():
+    if request.endpoint in (None, 'static', f'{bp.name}.healthz'):
+        return # health checks and static files must not wait for a Firestore connection
+    if ADMIN_SNAPSHOT_INTERVAL > 0 and get_db():
+        admin_snapshot_scheduler.ensure_started()
+
+@bp.cli.command('admin-snapshot')
+@click.option('--loop', is_flag=True, help='Keep refreshing every ADMIN_SNAPSHOT_INTERVAL seconds.')
+def admin_snapshot_command(loop):
+    """Precomputes the admin dashboard snapshot."""
+    while True:
+        snapshot = store_admin_snapshot()
+        print(f"Admin snapshot stored at {snapshot['generated_at']}")
+        if not loop:
+            break
+        time.sleep(ADMIN_SNAPSHOT_INTERVAL)
+
+# --- Admin Jobs ---
+DELETE_JOB_PARALLELISM = int(os.environ.get('DELETE_JOB_PARALLELISM', 4))
+DELETE_JOB_MAX_USERS = 500
+# A worker runs a job only while it holds the job's lease, claimed in a transaction and
+# renewed every JOB_HEARTBEAT_INTERVAL seconds by a heartbeat thread, however long a
+# single user's deletion takes. A queued or running job whose lease lapsed for
+# JOB_HEARTBEAT_TIMEOUT died with its worker and can be resumed.
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_HEARTBEAT_TIMEOUT = 300
+
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+def job_executor():
+    """Returns this process's background job pool, creating it on first use (after any fork)."""
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='admin-jobs')
+        return _job_executor
+
+def collect_document_tree(doc_ref):
+    """Returns every document nested under doc_ref's subcollections, deepest first."""
+    refs = []
+    for subcollection in doc_ref.collections():
+        for child in subcollection.list_documents():
+            refs.extend(collect_document_tree(child))
+            refs.append(child)
+    return refs
+
+def delete_user_records(user_id):
+    """Deletes every document belonging to a user and returns how many were removed.
+
+    Nested documents go first, in chunked batches. The root documents and the counter
+    adjustments commit together last, so an interrupted run can simply be repeated.
+    """
+    user_ref = get_db().collection('users').document(user_id)
+    data_ref = get_db().collection('user_data').document(user_id)
+    user_doc, data_doc = user_ref.get(), data_ref.get()
+    transactions, coins = user_data_totals(data_doc.to_dict() if data_doc.exists else None)
+    created_day = signup_day((user_doc.to_dict() or {}).get('created_at')) if user_doc.exists else None
+
+    writer = BatchWriter()
+    for ref in collect_document_tree(data_ref) + collect_document_tree(user_ref):
+        writer.delete(ref)
+    writer.flush()
+
+    batch = get_db().batch()
+    batch.delete(data_ref)
+    batch.delete(get_db().collection('user_summaries').document(user_id))
+    batch.delete(user_ref)
+    username_lower = (user_doc.to_dict() or {}).get('username_lower') if user_doc.exists else None
+    if username_lower:
+        reservation_ref = get_db().collection('usernames').document(username_lower)
+        reservation = reservation_ref.get()
+        if reservation.exists and (reservation.to_dict() or {}).get('user_id') == user_id:
+            batch.delete(reservation_ref)
+    record_stats_delta(batch, users=-1 if user_doc.exists else 0, transactions=-transactions, coins=-coins,
+                       signup_day=created_day, signups=-1 if user_doc.exists else 0)
+    batch.commit()
+    return writer.committed + int(user_doc.exists) + int(data_doc.exists)
+
+def job_lease_expired(job):
+    if job.get('lease_expires'):
+        expires = datetime.fromisoformat(job['lease_expires'])
+    else:
+        expires = datetime.fromisoformat(job['updated_at']) + timedelta(seconds=JOB_HEARTBEAT_TIMEOUT)
+    return expires < datetime.now(timezone.utc)
+
+def claim_job(job_id, lease_id=None):
+    """Takes the job's lease for this worker unless another live worker holds it; returns the lease id or None.
+
+    Passing the current lease_id renews it instead, and fails once it was taken over.
+    """
+    job_ref = get_db().collection('admin_jobs').document(job_id)
+    new_lease = lease_id or str(uuid.uuid4())
+
+    def claim(transaction):
+        snapshot = job_ref.get(transaction=transaction)
+        job = snapshot.to_dict() if snapshot.exists else None
+        if job is None:
+            return None
+        if lease_id is not None:
+            if job.get('lease_id') != lease_id:
+                return None
+        elif job['status'] == 'completed' or (job['status'] == 'running' and not job_lease_expired(job)):
+            return None
+        now = datetime.now(timezone.utc)
+        update = {
+            'lease_id': new_lease,
+            'lease_expires': (now + timedelta(seconds=JOB_HEARTBEAT_TIMEOUT)).isoformat(),
+            'updated_at': now.isoformat(),
+        }
+        if lease_id is None:
+            update.update(status='running', failed={})
+        transaction.update(job_ref, update)
+        return new_lease
+
+    return firestore.transactional(claim)(get_db().transaction())
+
+def run_delete_job(job_id):
+    lease_id = claim_job(job_id)
+    if lease_id is None:
+        print(f"Delete job {job_id} is already running elsewhere or finished")
+        return
+    job_ref = get_db().collection('admin_jobs').document(job_id)
+    job = job_ref.get().to_dict()
+    completed = set(job.get('completed_user_ids', []))
+    remaining = [user_id for user_id in job['user_ids'] if user_id not in completed]
+
+    lease_lost, finished = threading.Event(), threading.Event()
+
+    def heartbeat():
+        while not finished.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                if claim_job(job_id, lease_id) is None:
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                print(f"Delete job {job_id} heartbeat failed: {e}")
+
+    threading.Thread(target=heartbeat, name=f'job-heartbeat-{job_id[:8]}', daemon=True).start()
+    failed = False
+    try:
+        with ThreadPoolExecutor(max_workers=DELETE_JOB_PARALLELISM) as pool:
+            futures = {pool.submit(delete_user_records, user_id): user_id for user_id in remaining}
+            for future in as_completed(futures):
+                if lease_lost.is_set():
+                    # Another worker took the job over; it redoes whatever is left.
+                    for pending in futures:
+                        pending.cancel()
+                    print(f"Delete job {job_id} lost its lease; stopping")
+                    return
+                user_id = futures[future]
+                try:
+                    deleted = future.result()
+                    job_ref.update({
+                        'completed_user_ids': firestore.ArrayUnion([user_id]),
+                        'deleted_documents': firestore.Increment(deleted),
+                        'updated_at': dt_now_iso(),
+                    })
+                except Exception as e:
+                    failed = True
+                    print(f"Delete job {job_id} failed for user {user_id}: {e}")
+                    job_ref.set({'failed': {user_id: str(e)}, 'updated_at': dt_now_iso()}, merge=True)
+    finally:
+        finished.set()
+
+    job_ref.update({'status': 'completed_with_errors' if failed else 'completed', 'updated_at': dt_now_iso(),
+                    'lease_id': None, 'lease_expires': None})
+
+def submit_job(job_id):
+    def run():
+        try:
+            run_delete_job(job_id)
+        except Exception as e:
+            print(f"Delete job {job_id} crashed: {e}")
+            get_db().collection('admin_jobs').document(job_id).update({'status': 'failed', 'updated_at': dt_now_iso()})
+    job_executor().submit(run)
+
+def start_delete_job(user_ids, created_by):
+    job_id = str(uuid.uuid4())
+    get_db().collection('admin_jobs').document(job_id).set({
+        'type': 'delete_users',
+        'status': 'queued',
+        'user_ids': user_ids,
+        'completed_user_ids': [],
+        'failed': {},
+        'deleted_documents': 0,
+        'created_by': created_by,
+        'created_at': dt_now_iso(),
+        'updated_at': dt_now_iso(),
+    })
+    submit_job(job_id)
+    return job_id
+
+def describe_job(job_id, job):
+    status = job['status']
+    if status in ('queued', 'running') and job_lease_expired(job):
+        status = 'interrupted'
+    return {
+        'job_id': job_id,
+        'type': job['type'],
+        'status': status,
+        'total': len(job['user_ids']),
+        'completed': len(job.get('completed_user_ids', [])),
+        'failed': job.get('failed', {}),
+        'deleted_documents': job.get('deleted_documents', 0),
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at'],
+    }
+
+# --- Storage Resilience ---
+# Profile reads and writes go through storage_call(): every attempt has a deadline,
+# transient errors are retried with jittered backoff, and once Firestore keeps failing
+# the breaker opens so requests fail fast (or are served from the stale cache)
+# instead of each worker waiting out its own timeouts.
+FIRESTORE_DEADLINE = float(os.environ.get('FIRESTORE_DEADLINE', 5))
+FIRESTORE_RETRIES = int(os.environ.get('FIRESTORE_RETRIES', 2))
+FIRESTORE_RETRY_BASE = 0.1
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+STALE_CACHE_PROFILES = int(os.environ.get('STALE_CACHE_PROFILES', 256))
+
+# Extended with the Firestore client's retryable errors once the SDK is imported.
+TRANSIENT_STORAGE_ERRORS = (TimeoutError, ConnectionError)
+
+class StorageUnavailable(Exception):
+    """Firestore could not be reached in time, or the breaker is open."""
+
+    def __init__(self, retry_after=BREAKER_RESET_SECONDS):
+        super().__init__('Storage temporarily unavailable')
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `reset_after` seconds one probe call is let through."""
+
+    def __init__(self, threshold, reset_after):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_owner = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if self.probing else 'open'
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.reset_after:
+                self.probing = True
+                self.probe_owner = threading.get_ident()
+                return True
+            return False
+
+    def end_probe(self):
+        """Lets another probe through if this thread's probe ended without recording a result."""
+        with self.lock:
+            if self.probing and self.probe_owner == threading.get_ident():
+                self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 1
+        return max(1, math.ceil(self.reset_after - (time.monotonic() - self.opened_at)))
+
+storage_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+def storage_call(method, *args, idempotent=True, **kwargs):
+    """Calls a Firestore method under the deadline, retry and breaker policy.
+
+    Non-idempotent calls (batch commits with increments) are never retried: a timed-out
+    attempt may still have been applied. Other errors (a conflict, a denied permission)
+    mean Firestore answered, so they count as the backend being reachable.
+    """
+    if not storage_breaker.allow():
+        raise StorageUnavailable(storage_breaker.retry_after())
+    deadline = time.monotonic() + FIRESTORE_DEADLINE
+    attempts = FIRESTORE_RETRIES + 1 if idempotent else 1
+    try:
+        for attempt in range(attempts):
+            try:
+                # retry=None: the client's own retry policy would wait far past our deadline.
+                result = method(*args, timeout=max(deadline - time.monotonic(), 0.1), retry=None, **kwargs)
+            except TRANSIENT_STORAGE_ERRORS as e:
+                backoff = random.uniform(0, FIRESTORE_RETRY_BASE * 2 ** attempt)
+                if attempt + 1 < attempts and time.monotonic() + backoff < deadline:
+                    time.sleep(backoff)
+                    continue
+                storage_breaker.record_failure()
+                print(f"Firestore call {getattr(method, '__name__', method)} failed after {attempt + 1} attempt(s): {e}")
+                raise StorageUnavailable(storage_breaker.retry_after()) from e
+            except Exception:
+                storage_breaker.record_success()
+                raise
+            storage_breaker.record_success()
+            return result
+    finally:
+        # A probe interrupted any other way must not leave the breaker half-open for good.
+        storage_breaker.end_probe()
+
+class StaleProfileCache:
+    """The last successfully loaded copy of recently used profiles, kept serialized so callers can't mutate it."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, key, transactions, settings):
+        if self.max_entries <= 0:
+            return
+        blob = dumps_json([transactions, settings])
+        with self.lock:
+            self.entries[key] = (blob, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key):
+        """Returns (transactions, settings, age in seconds), or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+        transactions, settings = json.loads(entry[0])
+        return transactions, settings, time.time() - entry[1]
+
+stale_profiles = StaleProfileCache(STALE_CACHE_PROFILES)
+
+@bp.app_errorhandler(StorageUnavailable)
+def handle_storage_unavailable(e):
+    response = json_response({'success': False, 'error': 'Storage is temporarily unavailable, please try again shortly'}, 503)
+    response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+    return response
+
+@bp.after_app_request
+def flag_stale_response(response):
+    if g.get('storage_stale_age') is not None:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['Age'] = str(int(g.storage_stale_age))
+    return response
+
+# --- Async Firestore Reads ---
+# Independent reads for one request are issued concurrently on Firestore's AsyncClient,
+# driven by a single event-loop thread per process. Routes stay synchronous; only the
+# wait is shared. With ASYNC_READS=0 or no async client, the same reads go out as one
+# batched get_all on the sync client.
+ASYNC_READS = os.environ.get('ASYNC_READS', '1') != '0'
+
+class AsyncFirestoreRunner:
+    def __init__(self):
+        self.loop = None
+        self.client = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def available(self):
+        return ASYNC_READS and get_db() is not None and FIRESTORE_ASYNC_AVAILABLE
+
+    def _ensure_started(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # First use in this process; the loop thread doesn't survive a fork, so a
+            # preloaded parent's runner is rebuilt in each worker.
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='firestore-async', daemon=True)
+            thread.start()
+            try:
+                self.client = asyncio.run_coroutine_threadsafe(self._create_client(), loop).result()
+            except BaseException:
+                # Stop this loop's thread; the next call starts afresh.
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+                raise
+            self.loop, self.pid = loop, os.getpid()
+
+    @staticmethod
+    async def _create_client():
+        # Created on the loop so its gRPC channel binds to it.
+        return firestore_async.client()
+
+    def run(self, coroutine_fn, *args, timeout=None):
+        self._ensure_started()
+        future = asyncio.run_coroutine_threadsafe(coroutine_fn(self.client, *args), self.loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+async_firestore = AsyncFirestoreRunner()
+
+async def _gather_documents(client, paths, timeout, retry):
+    return await asyncio.gather(*(client.document(path).get(timeout=timeout, retry=retry) for path in paths))
+
+def read_documents(paths, timeout=None, retry=None):
+    """Returns snapshots for several document paths, in order, fetched together. Usable with storage_call()."""
+    if not async_firestore.available():
+        snapshots = {snap.reference.path: snap for snap in get_db().get_all([get_db().document(p) for p in paths], timeout=timeout, retry=retry)}
+        return [snapshots[path] for path in paths]
+    started = time.perf_counter()
+    snapshots = async_firestore.run(_gather_documents, paths, timeout, retry, timeout=timeout)
+    record_firestore_call(reads=len(snapshots), nbytes=sum(_snapshot_size(s) for s in snapshots),
+                          seconds=time.perf_counter() - started)
+    return snapshots
+
+# --- Request Document Cache ---
+# Within one request a document is read at most once: the snapshot is kept in `g` and
+# reused by later reads, including the sub-requests of an /api/batch call. Writers
+# drop their document from the cache so a read after a write sees the new data.
+def cached_document(doc_ref):
+    if not has_app_context():
+        return storage_call(doc_ref.get)
+    cache = g.setdefault('document_cache', {})
+    if doc_ref.path not in cache:
+        cache[doc_ref.path] = storage_call(doc_ref.get)
+    return cache[doc_ref.path]
+
+def seed_document_cache(snapshots):
+    cache = g.setdefault('document_cache', {})
+    for snapshot in snapshots:
+        cache[snapshot.reference.path] = snapshot
+
+def forget_document(doc_ref):
+    if has_app_context():
+        g.get('document_cache', {}).pop(doc_ref.path, None)
+
+# --- Live Updates ---
+# Compact change events are published per user (`user:<id>`) and to everyone
+# (`broadcast`), and pushed to open /api/events streams. With REDIS_URL they travel
+# over Redis pub/sub so a change handled by one worker reaches streams held by others.
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MS = 3000
+# Streams are closed (and reopened by the browser) after this long so a worker's
+# threads are never held indefinitely.
+SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 300))
+# Under thread-per-request workers every open stream holds a thread, so streams may take
+# all but RESERVED_REQUEST_THREADS of them, leaving those for ordinary requests (sync
+# workers, with one thread, serve no streams). gevent streams cost no thread.
+RESERVED_REQUEST_THREADS = 2
+
+def request_threads():
+    """Request threads per worker process, or None under gevent, where a waiting request holds no thread."""
+    worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+    if worker_class == 'gevent':
+        return None
+    return int(os.environ.get('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+
+def sse_connection_limit():
+    limit = int(os.environ.get('SSE_MAX_CONNECTIONS', 50))
+    threads = request_threads()
+    if threads is None:
+        return limit
+    return max(0, min(limit, threads - RESERVED_REQUEST_THREADS))
+
+SSE_MAX_CONNECTIONS = sse_connection_limit()
+SSE_QUEUE_SIZE = 100
+REDIS_EVENT_PREFIX = 'coin_tracker:events:'
+
+class EventBus:
+    """In-process pub/sub; every open stream holds one bounded queue."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels):
+        events = queue.Queue(SSE_QUEUE_SIZE)
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].add(events)
+        return events
+
+    def unsubscribe(self, events, channels):
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].discard(events)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+    def publish(self, channel, event):
+        self.deliver(channel, event)
+
+    def deliver(self, channel, event):
+        with self.lock:
+            targets = list(self.subscribers.get(channel, ()))
+        for events in targets:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass # a stalled client misses events; it reloads everything when it reconnects
+
+class RedisEventBus(EventBus):
+    """Publishes through Redis; one listener thread per process fans messages out to local streams."""
+
+    def __init__(self, url):
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.listener_pid = None
+        self.listener_lock = threading.Lock()
+
+    def subscribe(self, channels):
+        self._ensure_listening()
+        return super().subscribe(channels)
+
+    def publish(self, channel, event):
+        try:
+            self.client.publish(REDIS_EVENT_PREFIX + channel, dumps_json(event))
+        except Exception as e:
+            print(f"Event bus publish error: {e}")
+            self.deliver(channel, event)
+
+    def _ensure_listening(self):
+        with self.listener_lock:
+            if self.listener_pid != os.getpid():
+                threading.Thread(target=self._listen, name='event-bus', daemon=True).start()
+                self.listener_pid = os.getpid()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(REDIS_EVENT_PREFIX + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode('utf-8')[len(REDIS_EVENT_PREFIX):]
+                    self.deliver(channel, json.loads(message['data']))
+            except Exception as e:
+                print(f"Event bus listener error: {e}")
+                time.sleep(1)
+
+event_bus = EventBus()
+if os.environ.get('REDIS_URL') and REDIS_AVAILABLE:
+    event_bus = RedisEventBus(os.environ['REDIS_URL'])
+
+sse_slots = threading.BoundedSemaphore(SSE_MAX_CONNECTIONS)
+
+def publish_event(channel, event_type, **fields):
+    """Publishes a change event. `origin` lets the tab that made the change skip its own echo."""
+    event = {'type': event_type, 'at': dt_now_iso(), **fields}
+    if has_request_context() and request.headers.get('X-Client-Id'):
+        event['origin'] = request.headers['X-Client-Id']
+    event_bus.publish(channel, event)
+
+def format_sse(event):
+    return f"event: {event['type']}\ndata: {dumps_json(event).decode('utf-8')}\n\n"
+
+# --- Transaction Archive ---
+# Transactions from months older than ARCHIVE_AFTER_DAYS move out of the profile (the
+# hot record every read downloads) into immutable zlib-compressed chunks under
+# user_data/{uid}/transaction_archive, one or more per month. Each chunk's totals live
+# in the user document's top-level `transaction_archive` index, so the dashboard never
+# opens a chunk; history and export load only the chunks their range reaches.
+# The profile keeps one carry-forward transaction holding the archived net, so clients
+# that just sum the profile's transactions (Android, desktop) still show the right
+# balance. 0 disables archiving.
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 0))
+if 0 < ARCHIVE_AFTER_DAYS < 62:
+    ARCHIVE_AFTER_DAYS = 62 # the dashboard's month stats and streaks read the profile only
+ARCHIVE_CARRY_ID = 'archived-balance'
+ARCHIVE_CARRY_SOURCE = 'Archived transactions'
+ARCHIVE_CHUNK_MAX_BYTES = 512 * 1024
+
+def is_archive_carry(t):
+    return t.get('id') == ARCHIVE_CARRY_ID
+
+def archive_cutoff():
+    """First day of the oldest month that stays in the profile."""
+    return (datetime.now(timezone.utc).date() - timedelta(days=ARCHIVE_AFTER_DAYS)).replace(day=1)
+
+def pack_chunk(transactions):
+    return zlib.compress(dumps_json(transactions), 6)
+
+def unpack_chunk(data):
+    return json.loads(zlib.decompress(data))
+
+def summarize_chunk(transactions):
+    """The index entry for a chunk: its totals, per-source totals and date bounds."""
+    dates = sorted(transaction_date(t).isoformat() for t in transactions)
+    earnings = sorted(transaction_date(t).isoformat() for t in transactions if t.get('amount', 0) > 0)
+    spends = sorted(transaction_date(t).isoformat() for t in transactions if t.get('amount', 0) < 0)
+    sources = {}
+    for t in transactions:
+        totals = sources.setdefault(t.get('source', ''), {'count': 0, 'earned': 0, 'spent': 0})
+        totals['count'] += 1
+        totals['earned' if t.get('amount', 0) > 0 else 'spent'] += abs(t.get('amount', 0))
+    return {
+        'count': len(transactions),
+        'earned': sum(s['earned'] for s in sources.values()),
+        'spent': sum(s['spent'] for s in sources.values()),
+        'sources': sources,
+        'first_date': dates[0],
+        'last_date': dates[-1],
+        'first_earning': earnings[0] if earnings else None,
+        'last_spend': spends[-1] if spends else None,
+    }
+
+def build_chunks(month, transactions):
+    """Packs one month's transactions into chunks under ARCHIVE_CHUNK_MAX_BYTES; returns [(meta, data)]."""
+    data = pack_chunk(transactions)
+    if len(data) > ARCHIVE_CHUNK_MAX_BYTES and len(transactions) > 1:
+        middle = len(transactions) // 2
+        return build_chunks(month, transactions[:middle]) + build_chunks(month, transactions[middle:])
+    meta = {'id': f'{month}-{uuid.uuid4().hex[:8]}', 'month': month, **summarize_chunk(transactions)}
+    return [(meta, data)]
+
+def archive_summary(chunks):
+    """Totals over a profile's archived chunks, in the shape dashboard_payload needs."""
+    sources = defaultdict(lambda: {'earned': 0, 'spent': 0})
+    timeline, balance = [], 0
+    for chunk in sorted(chunks, key=lambda c: c['last_date']):
+        for source, totals in chunk['sources'].items():
+            sources[source]['earned'] += totals['earned']
+            sources[source]['spent'] += totals['spent']
+        balance += chunk['earned'] - chunk['spent']
+        timeline.append({'date': chunk['last_date'], 'balance': balance})
+    return {
+        'count': sum(c['count'] for c in chunks),
+        'earned': sum(c['earned'] for c in chunks),
+        'spent': sum(c['spent'] for c in chunks),
+        'sources': dict(sources),
+        'timeline': timeline,
+        'first_date': min((c['first_date'] for c in chunks), default=None),
+        'first_earning': min((c['first_earning'] for c in chunks if c['first_earning']), default=None),
+        'last_spend': max((c['last_spend'] for c in chunks if c['last_spend']), default=None),
+    }
+
+def with_archive_carry(transactions, chunks):
+    """Replaces the carry-forward transaction with one matching the archived chunks."""
+    transactions = [t for t in transactions if not is_archive_carry(t)]
+    if chunks:
+        transactions.append({
+            'id': ARCHIVE_CARRY_ID,
+            'date': f"{max(c['last_date'] for c in chunks)}T23:59:59+00:00",
+            'amount': sum(c['earned'] - c['spent'] for c in chunks),
+            'source': ARCHIVE_CARRY_SOURCE,
+        })
+    return transactions
+
+def chunk_overlaps(chunk, date_from=None, date_to=None):
+    return (not date_from or chunk['last_date'] >= date_from.isoformat()) and \
+        (not date_to or chunk['first_date'] <= date_to.isoformat())
+
+def chunk_within(chunk, date_from=None, date_to=None):
+    return (not date_from or chunk['first_date'] >= date_from.isoformat()) and \
+        (not date_to or chunk['last_date'] <= date_to.isoformat())
+
+@bp.cli.command('archive-transactions')
+def archive_transactions_command():
+    """Archives old transactions of every profile now, instead of on its next save."""
+    if not ARCHIVE_AFTER_DAYS:
+        raise click.ClickException('Set ARCHIVE_AFTER_DAYS to enable archiving')
+    cutoff = archive_cutoff()
+    archived = 0
+    for user_doc in get_db().collection('user_data').stream():
+        for profile_name, profile in ((user_doc.to_dict() or {}).get('profiles') or {}).items():
+            if not any((transaction_date(t) or cutoff) < cutoff for t in profile.get('transactions', [])
+                       if not is_archive_carry(t)):
+                continue
+            tracker = WebCoinTracker(profile_name, user_doc.id)
+            transactions, settings = tracker.get_data()
+            if tracker.save_data(transactions, settings, change={'op': 'transactions_archived'}):
+                archived += 1
+    print(f"Archived old transactions of {archived} profiles")
+
+# --- Change Journal ---
+# Besides rewriting the profile, every save records what changed as one small entry in
+# user_data/{uid}/journal: the operation (named like the live-update events), the
+# transaction or settings it carried, the profile's new version and a timestamp. The
+# entry is created in the save's batch, so two saves racing from the same version can't
+# both commit: the later one fails instead of silently overwriting the other.
+# The profile stays the snapshot every client reads, stamped with its version. The
+# user document's top-level `change_journal` map holds, per profile, the current
+# version, the oldest version a client can catch up from (`base_version`) and how far
+# entries have been compacted. /api/changes?since=N returns the entries after N, or
+# tells the client to reload when they can't rebuild the profile from version N: after
+# an import or a save that moved transactions in or out of the archive, after a write
+# from a client that doesn't keep the journal (Android drops the stamp), or when the
+# entries were compacted away. Entries JOURNAL_RETAIN versions old are deleted,
+# JOURNAL_COMPACT_EVERY at a time.
+JOURNAL_RETAIN = int(os.environ.get('JOURNAL_RETAIN', 500))
+JOURNAL_COMPACT_EVERY = int(os.environ.get('JOURNAL_COMPACT_EVERY', 50))
+JOURNAL_SYNC_MAX = 100 # entries per /api/changes response
+# Operations recorded without a payload: catching up past them means reloading the profile.
+JOURNAL_RELOAD_OPS = {'profile_created', 'profile_replaced', 'transactions_archived'}
+# Times a save that lost a race to another save is redone on the newer profile.
+SAVE_CONFLICT_RETRIES = int(os.environ.get('SAVE_CONFLICT_RETRIES', 2))
+
+def journal_entry_id(profile_name, version):
+    # Profile names can hold characters a document id can't, so they are hashed.
+    return f"{hashlib.sha1(profile_name.encode('utf-8')).hexdigest()[:16]}-{version:010d}"
+
+def journal_state(data, profile_name):
+    """A profile's journal metadata from its user_data document, and whether the profile snapshot is at that version."""
+    state = {'version': 0, 'base_version': 0, 'compacted_version': 0}
+    state.update((data.get('change_journal') or {}).get(profile_name) or {})
+    profile = (data.get('profiles') or {}).get(profile_name) or {}
+    return state, profile.get('journal_version') == state['version']
+
+def journal_entry(profile_name, version, change):
+    entry = {**change, 'profile': profile_name, 'version': version, 'timestamp': dt_now_iso()}
+    if 'transaction' in entry:
+        entry['transaction'] = {k: v for k, v in entry['transaction'].items() if k != 'previous_balance'}
+    return entry
+
 # --- Data Access Class ---
 class WebCoinTracker:
     def __init__(self, profile_name="Default", user_id="default_user"):
         self.profile_name = profile_name
         self.user_id = user_id
-        self.db = db
+        self.db = get_db()
         self.doc_ref = self.db.collection('user_data').document(self.user_id) if self.db and FIREBASE_AVAILABLE else None
+        self.loaded_stale = False
+        # Index entries of the profile's archived chunks, and chunks pulled back for editing.
+        self.archive_chunks = []
+        self.restored_chunk_ids = set()
+        self.journal_version = 0
+        # Journal version get_data found, which a save must still find to write over it.
+        self.loaded_version = None
 
     def get_default_settings(self):
         return {
@@ -205,42 +2001,99 @@ class WebCoinTracker:
             ]
         }
 
+    @traced('get_data')
     def get_data(self):
         transactions, settings = [], self.get_default_settings()
         if self.doc_ref:
             try:
-                doc = self.doc_ref.get()
-                if doc.exists:
-                    data = doc.to_dict()
-
-                    if data is None: 
-                        data = {}
-
-                    if 'profiles' in data:
-                        profile_data = data.get('profiles', {}).get(self.profile_name, {})
-                        transactions = profile_data.get('transactions', [])
-                        settings.update(profile_data.get('settings', {}))
-                    
-                    elif 'transactions' in data or 'settings' in data:
-                        print(f"NOTE: Found old data structure for user {self.user_id}. Reading data...")
-                        transactions = data.get('transactions', [])
-                        settings.update(data.get('settings', {}))
-                    
-            except Exception as e: 
-                print(f"Firebase load error for user {self.user_id}: {e}")
+                doc = cached_document(self.doc_ref)
+            except StorageUnavailable:
+                cached = stale_profiles.get((self.user_id, self.profile_name))
+                if cached is None:
+                    raise
+                # Served read-only: save_data refuses to write back data loaded this way.
+                transactions, cached_settings, age = cached
+                settings.update(cached_settings)
+                self.loaded_stale = True
+                if has_app_context():
+                    g.storage_stale_age = age
+            else:
+                data = (doc.to_dict() or {}) if doc.exists else {}
+                self.journal_version = self.loaded_version = journal_state(data, self.profile_name)[0]['version']
+
+                if 'profiles' in data:
+                    profile_data = data.get('profiles', {}).get(self.profile_name, {})
+                    transactions = profile_data.get('transactions', [])
+                    settings.update(profile_data.get('settings', {}))
+                    self.archive_chunks = (data.get('transaction_archive') or {}).get(self.profile_name, {}).get('chunks', [])
+                    if self.archive_chunks:
+                        # Another client may have edited or dropped the carry-forward entry.
+                        transactions = with_archive_carry(transactions, self.archive_chunks)
+
+                elif 'transactions' in data or 'settings' in data:
+                    print(f"NOTE: Found old data structure for user {self.user_id}. Reading data...")
+                    transactions = data.get('transactions', [])
+                    settings.update(data.get('settings', {}))
+
+                stale_profiles.put((self.user_id, self.profile_name), transactions, settings)
         else:
             profile_data = session.get('profiles', {}).get(self.profile_name, {})
             transactions = profile_data.get('transactions', [])
             settings.update(profile_data.get('settings', {}))
         
+        if has_app_context():
+            g.txn_count = len(transactions)
         return self.validate_data(transactions, settings)
 
+    @traced('get_transactions_paginated')
     def get_transactions_paginated(self, page=1, limit=20, filters=None):
         if filters is None:
             filters = {}
             
         transactions, _ = self.get_data()
+        filtered_transactions = self.filter_transactions([t for t in transactions if not is_archive_carry(t)], filters)
+
+        # Archived chunks are opened only when the page or a filter needs their rows;
+        # otherwise their index totals stand in for them.
+        date_from, date_to = filter_date(filters.get('date_from')), filter_date(filters.get('date_to'))
+        chunks = [c for c in self.archive_chunks if chunk_overlaps(c, date_from, date_to)
+                  and (not filters.get('source') or filters['source'] in c['sources'])]
+        archived_count = archived_earned = archived_spent = 0
+        if chunks:
+            newest_archived = max(c['last_date'] for c in chunks)
+            newer = sum(1 for t in filtered_transactions if t.get('date', '')[:10] > newest_archived)
+            if not filters.get('search') and page * limit <= newer and all(chunk_within(c, date_from, date_to) for c in chunks):
+                for c in chunks:
+                    totals = c['sources'][filters['source']] if filters.get('source') else c
+                    archived_count += totals['count']
+                    archived_earned += totals['earned']
+                    archived_spent += totals['spent']
+            else:
+                filtered_transactions += self.filter_transactions(self.load_archived(chunks), filters)
+
+        sorted_transactions = sorted(filtered_transactions, key=lambda x: x.get('date', ''), reverse=True)
         
+        total_earned_in_range = sum(t['amount'] for t in filtered_transactions if t['amount'] > 0) + archived_earned
+        total_spent_in_range = sum(t['amount'] for t in filtered_transactions if t['amount'] < 0) - archived_spent
+
+        total_transactions = len(sorted_transactions) + archived_count
+        total_pages = (total_transactions + limit - 1) // limit 
+        
+        start_index = (page - 1) * limit
+        end_index = start_index + limit
+        
+        paginated_txns = sorted_transactions[start_index:end_index]
+        
+        return {
+            'transactions': paginated_txns,
+            'total_pages': total_pages,
+            'current_page': page,
+            'total_transactions': total_transactions,
+            'total_earned': total_earned_in_range,
+            'total_spent': total_spent_in_range,
+        }
+
+    def filter_transactions(self, transactions, filters):
         filtered_transactions = []
         for t in transactions:
             try:
@@ -273,29 +2126,109 @@ class WebCoinTracker:
                     continue
             
             filtered_transactions.append(t)
-
-        sorted_transactions = sorted(filtered_transactions, key=lambda x: x.get('date', ''), reverse=True)
-        
-        total_earned_in_range = sum(t['amount'] for t in filtered_transactions if t['amount'] > 0)
-        total_spent_in_range = sum(t['amount'] for t in filtered_transactions if t['amount'] < 0)
-
-        total_transactions = len(sorted_transactions)
-        total_pages = (total_transactions + limit - 1) // limit 
-        
-        start_index = (page - 1) * limit
-        end_index = start_index + limit
-        
-        paginated_txns = sorted_transactions[start_index:end_index]
-        
-        return {
-            'transactions': paginated_txns,
-            'total_pages': total_pages,
-            'current_page': page,
-            'total_transactions': total_transactions,
-            'total_earned': total_earned_in_range,
-            'total_spent': total_spent_in_range,
-        }
-
+        return filtered_transactions
+
+    def load_archived(self, chunks):
+        """Returns the transactions stored in the given archived chunks."""
+        return [t for rows in self._read_chunks(chunks) for t in rows]
+
+    def _read_chunks(self, chunks):
+        if not chunks:
+            return []
+        paths = [f"user_data/{self.user_id}/transaction_archive/{c['id']}" for c in chunks]
+        return [unpack_chunk(snapshot.get('data')) if snapshot.exists else []
+                for snapshot in storage_call(read_documents, paths)]
+
+    def restore_archived(self, transaction_id):
+        """Finds an archived transaction and returns its chunk's transactions, to be saved back into the profile.
+
+        save_data then deletes the chunk; whatever is still old goes into a new one.
+        """
+        chunks = [c for c in self.archive_chunks if c['id'] not in self.restored_chunk_ids]
+        for chunk, transactions in zip(chunks, self._read_chunks(chunks)):
+            if any(t.get('id') == transaction_id for t in transactions):
+                self.restored_chunk_ids.add(chunk['id'])
+                return transactions
+        return []
+
+    def iter_transaction_pages(self, page_size=500, date_from=None, date_to=None):
+        """Returns an iterator over the profile's transactions oldest first, at most page_size at a time.
+
+        The profile is loaded before returning so storage errors surface before a streamed response
+        starts. The archived chunks the range reaches are read one at a time as the pages get to them;
+        chunks wholly before the range only count towards the opening balance.
+        """
+        transactions, _ = self.get_data()
+        transactions = [t for t in transactions if not is_archive_carry(t)]
+        before = [c for c in self.archive_chunks if date_from and c['last_date'] < date_from.isoformat()]
+        opening = sum(c['earned'] - c['spent'] for c in before)
+        reached = sorted((c for c in self.archive_chunks if c not in before and chunk_overlaps(c, None, date_to)),
+                         key=lambda c: c['first_date'])
+        return self._transaction_pages(self._oldest_first(transactions, reached), page_size, date_from, date_to, opening)
+
+    def _oldest_first(self, transactions, chunks):
+        """Yields transactions merged with those of chunks, sorted by first_date, oldest first.
+
+        A chunk is only read once everything dated before it is out, so at most the chunks whose
+        dates overlap are held at once.
+        """
+        pending = [(t.get('date', ''), seq, t) for seq, t in enumerate(transactions)]
+        heapq.heapify(pending)
+        seq = len(pending)
+        for index, chunk in enumerate(chunks):
+            for t in self.load_archived([chunk]):
+                heapq.heappush(pending, (t.get('date', ''), seq, t))
+                seq += 1
+            next_first = chunks[index + 1]['first_date'] if index + 1 < len(chunks) else None
+            while pending and (next_first is None or pending[0][0][:10] < next_first):
+                yield heapq.heappop(pending)[2]
+        while pending:
+            yield heapq.heappop(pending)[2]
+
+    def _transaction_pages(self, transactions, page_size, date_from, date_to, opening=0):
+        page, balance = [], opening
+        for t in transactions:
+            t['previous_balance'] = balance
+            balance += t.get('amount', 0)
+            if date_from or date_to:
+                t_date = transaction_date(t)
+                if t_date is None:
+                    continue
+                if date_from and t_date < date_from:
+                    continue
+                if date_to and t_date > date_to:
+                    continue
+            page.append(t)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    @traced('get_changes')
+    def get_changes(self, since):
+        """Journal entries after version `since`, oldest first, at most JOURNAL_SYNC_MAX of them.
+
+        reset is True when they can't bring a copy of the profile at that version up to date;
+        the client reloads it instead.
+        """
+        changes = {'version': self.journal_version, 'changes': [], 'reset': True, 'has_more': False}
+        if not self.doc_ref:
+            return changes
+        doc = cached_document(self.doc_ref)
+        journal, in_sync = journal_state((doc.to_dict() or {}) if doc.exists else {}, self.profile_name)
+        changes['version'] = journal['version']
+        if not in_sync or not journal['base_version'] <= since <= journal['version']:
+            return changes
+        until = min(journal['version'], since + JOURNAL_SYNC_MAX)
+        paths = [f"user_data/{self.user_id}/journal/{journal_entry_id(self.profile_name, version)}"
+                 for version in range(since + 1, until + 1)]
+        snapshots = storage_call(read_documents, paths) if paths else []
+        if not all(snapshot.exists for snapshot in snapshots):
+            return changes
+        changes.update(changes=[snapshot.to_dict() for snapshot in snapshots], reset=False,
+                       has_more=until < journal['version'])
+        return changes
 
     def validate_data(self, transactions, settings):
         for t in transactions:
@@ -304,57 +2237,189 @@ class WebCoinTracker:
             settings['quick_actions'] = self.get_default_settings()['quick_actions']
         return transactions, settings
 
-    def save_data(self, transactions, settings):
-        transactions = self.recalculate_balances(transactions)
-        if self.doc_ref:
+    @traced('save_data')
+    def save_data(self, transactions, settings, replace_archive=False, change=None):
+        """Saves the profile. replace_archive drops its archived transactions, for a save that replaces them all.
+
+        change is the journal entry's operation and payload, e.g. {'op': 'transaction_deleted',
+        'transaction_id': ...}; without one the save is journaled as replacing the profile. If
+        another save got in since get_data, the profile is reloaded and change applied to it again.
+        """
+        if self.loaded_stale:
+            # Writing back a cached copy would silently drop changes made since it was cached.
+            raise StorageUnavailable(storage_breaker.retry_after())
+        if not self.doc_ref:
+            transactions = self.recalculate_balances(transactions)
+            profiles = dict(session.get('profiles', {}))
+            profiles[self.profile_name] = {'transactions': transactions, 'settings': settings, 'last_updated': dt_now_iso()}
+            if not session_fits({**session, 'profiles': profiles}):
+                print(f"Offline profile data for user {self.user_id} is too large for the session")
+                return False
+            session['profiles'] = profiles
+            session.modified = True
+            return True
+
+        change = change or {'op': 'profile_replaced'}
+        for attempt in range(SAVE_CONFLICT_RETRIES + 1):
             try:
-                doc = self.doc_ref.get()
-                data_to_save = {}
-                if doc.exists and doc.to_dict() is not None:
-                    data_to_save = doc.to_dict()
+                if attempt:
+                    transactions, settings = self.reload_with_change(transactions, settings, change)
+                self.commit_save(transactions, settings, replace_archive, change)
+                return True
+            except StorageUnavailable:
+                raise
+            except AlreadyExists:
+                print(f"Profile '{self.profile_name}' of user {self.user_id} was saved concurrently")
+            except Exception as e:
+                print(f"Firebase save error: {e}")
+                return False
+        return False
 
-                profiles_data = data_to_save.get('profiles', {})
+    def commit_save(self, transactions, settings, replace_archive, change):
+        """Writes the profile at the next journal version; raises AlreadyExists if another save took it."""
+        transactions = self.recalculate_balances(transactions)
+        doc = storage_call(self.doc_ref.get)
+        data_to_save = {}
+        if doc.exists and doc.to_dict() is not None:
+            data_to_save = doc.to_dict()
+
+        before = user_data_totals(data_to_save)
+        profiles_data = data_to_save.get('profiles', {})
+        archive_index = data_to_save.get('transaction_archive') or {}
+        chunks = archive_index.get(self.profile_name, {}).get('chunks', [])
+        retired = [c['id'] for c in chunks if replace_archive or c['id'] in self.restored_chunk_ids]
+        chunks = [c for c in chunks if c['id'] not in retired]
+        transactions, new_chunks = self.archive_old(self.recalculate_balances(with_archive_carry(transactions, chunks)))
+        chunks = chunks + [meta for meta, _ in new_chunks]
+        transactions = self.recalculate_balances(with_archive_carry(transactions, chunks))
+        if chunks or self.profile_name in archive_index:
+            archive_index[self.profile_name] = {'chunks': chunks}
+
+        journals = data_to_save.get('change_journal') or {}
+        journal, in_sync = journal_state(data_to_save, self.profile_name)
+        if self.loaded_version is not None and journal['version'] != self.loaded_version:
+            # Saved since get_data: writing this copy would drop that change from the snapshot.
+            raise AlreadyExists(f"profile is at version {journal['version']}, loaded {self.loaded_version}")
+        version = journal['version'] + 1
+        if change['op'] in JOURNAL_RELOAD_OPS or not in_sync or new_chunks or retired:
+            journal['base_version'] = version
+        expired = range(0)
+        if version - JOURNAL_RETAIN - journal['compacted_version'] >= JOURNAL_COMPACT_EVERY:
+            expired = range(journal['compacted_version'] + 1, journal['compacted_version'] + JOURNAL_COMPACT_EVERY + 1)
+            journal['compacted_version'] = expired[-1]
+            journal['base_version'] = max(journal['base_version'], journal['compacted_version'])
+        journal['version'] = version
+        journals[self.profile_name] = journal
                 
-                profiles_data[self.profile_name] = {
-                    'transactions': transactions, 
-                    'settings': settings, 
-                    'last_updated': dt_now_iso()
-                }
+        profiles_data[self.profile_name] = {
+            'transactions': transactions, 
+            'settings': settings, 
+            'last_updated': dt_now_iso(),
+            'journal_version': version,
+        }
                 
-                final_data = {
-                    'profiles': profiles_data,
-                    'last_active_profile': self.profile_name
-                }
+        final_data = {
+            'profiles': profiles_data,
+            'last_active_profile': self.profile_name,
+            'change_journal': journals,
+        }
+        if archive_index:
+            final_data['transaction_archive'] = archive_index
                 
-                if 'transactions' in data_to_save:
-                    final_data['transactions'] = firestore.DELETE_FIELD
-                if 'settings' in data_to_save:
-                    final_data['settings'] = firestore.DELETE_FIELD
+        if 'transactions' in data_to_save:
+            final_data['transactions'] = firestore.DELETE_FIELD
+        if 'settings' in data_to_save:
+            final_data['settings'] = firestore.DELETE_FIELD
                 
-                self.doc_ref.set(final_data, merge=True) 
+        after = user_data_totals({'profiles': profiles_data, 'transaction_archive': archive_index})
+        batch = self.db.batch()
+        journal_ref = self.doc_ref.collection('journal')
+        # create() fails the whole batch if another save already took this version.
+        batch.create(journal_ref.document(journal_entry_id(self.profile_name, version)),
+                     journal_entry(self.profile_name, version, change))
+        for expired_version in expired:
+            batch.delete(journal_ref.document(journal_entry_id(self.profile_name, expired_version)))
+        # Chunks are written with the profile that stops holding their transactions, so a
+        # transaction is never in both or in neither.
+        archive_ref = self.doc_ref.collection('transaction_archive')
+        for meta, data in new_chunks:
+            batch.set(archive_ref.document(meta['id']), {
+                'profile': self.profile_name,
+                'month': meta['month'],
+                'count': meta['count'],
+                'data': data,
+                'created_at': dt_now_iso(),
+            })
+        for chunk_id in retired:
+            batch.delete(archive_ref.document(chunk_id))
+        batch.set(self.doc_ref, final_data, merge=True)
+        batch.set(self.db.collection('user_summaries').document(self.user_id), {
+            'txn_count': after[0],
+            'balance': after[1],
+            'last_updated': profiles_data[self.profile_name]['last_updated'],
+        }, merge=True)
+        record_stats_delta(batch, transactions=after[0] - before[0], coins=after[1] - before[1])
+        storage_call(batch.commit, idempotent=False)
+        forget_document(self.doc_ref)
+        self.archive_chunks, self.restored_chunk_ids = chunks, set()
+        self.journal_version = self.loaded_version = version
+        stale_profiles.put((self.user_id, self.profile_name), transactions, settings)
                 
-                return True
-            except Exception as e:
-                print(f"Firebase save error: {e}")
-                return False
-        else:
-            profiles = session.get('profiles', {})
-            profiles[self.profile_name] = {'transactions': transactions, 'settings': settings, 'last_updated': dt_now_iso()}
-            session['profiles'] = profiles
-            session.modified = True
-            return True
-            
+
+    def reload_with_change(self, transactions, settings, change):
+        """Reloads the profile and applies change to it again; returns (transactions, settings) to save."""
+        forget_document(self.doc_ref)
+        self.restored_chunk_ids = set()
+        fresh_transactions, fresh_settings = self.get_data()
+        if self.loaded_stale:
+            raise StorageUnavailable(storage_breaker.retry_after())
+        op = change['op']
+        if op == 'profile_replaced':
+            return transactions, settings
+        if op in ('transaction_updated', 'transaction_deleted'):
+            transaction_id = change.get('transaction_id') or change['transaction']['id']
+            if not any(t.get('id') == transaction_id for t in fresh_transactions):
+                fresh_transactions += self.restore_archived(transaction_id)
+        if op in ('transaction_added', 'transaction_updated'):
+            transaction = dict(change['transaction'])
+            fresh_transactions = [t for t in fresh_transactions if t.get('id') != transaction['id']] + [transaction]
+        elif op == 'transaction_deleted':
+            fresh_transactions = [t for t in fresh_transactions if t.get('id') != change['transaction_id']]
+        elif op == 'settings_changed':
+            fresh_settings.update(change['settings'])
+        return fresh_transactions, fresh_settings
+
+    def archive_old(self, transactions):
+        """Splits off transactions from before the archive cutoff; returns (kept, [(meta, data)])."""
+        if not ARCHIVE_AFTER_DAYS:
+            return transactions, []
+        cutoff = archive_cutoff()
+        kept, months = [], defaultdict(list)
+        for t in transactions:
+            t_date = transaction_date(t)
+            if is_archive_carry(t) or t_date is None or t_date >= cutoff:
+                kept.append(t)
+            else:
+                months[t_date.strftime('%Y-%m')].append(t)
+        return kept, [chunk for month in sorted(months) for chunk in build_chunks(month, months[month])]
+
+    def publish(self, event_type, **fields):
+        publish_event(f'user:{self.user_id}', event_type, profile=self.profile_name, version=self.journal_version, **fields)
+
     def import_data(self, data):
         print(f"Importing data for user {self.user_id}...")
         transactions = data.get('transactions', [])
         settings = data.get('settings', self.get_default_settings())
         
         valid_transactions, valid_settings = self.validate_data(transactions, settings)
-        return self.save_data(valid_transactions, valid_settings)
+        if not self.save_data(valid_transactions, valid_settings, replace_archive=True):
+            return False
+        self.publish('profile_replaced')
+        return True
 
-    def recalculate_balances(self, transactions):
+    def recalculate_balances(self, transactions, opening=0):
         sorted_transactions = sorted(transactions, key=lambda x: x.get('date', ''))
-        balance = 0
+        balance = opening
         for t in sorted_transactions:
             t['previous_balance'] = balance
             balance += t.get('amount', 0)
@@ -362,100 +2427,186 @@ class WebCoinTracker:
 
     def add_transaction(self, amount, source, date):
         transactions, settings = self.get_data()
-        transactions.append({"id": str(uuid.uuid4()), "date": date or dt_now_iso(), "amount": int(amount), "source": source})
-        return self.save_data(transactions, settings)
+        transaction = {"id": str(uuid.uuid4()), "date": date or dt_now_iso(), "amount": int(amount), "source": source}
+        transactions.append(transaction)
+        if not self.save_data(transactions, settings, change={'op': 'transaction_added', 'transaction': transaction}):
+            return False
+        self.publish('transaction_added', transaction=transaction)
+        return True
 
     def update_transaction(self, transaction_id, new_data):
         transactions, settings = self.get_data()
+        if not any(t.get('id') == transaction_id for t in transactions):
+            transactions += self.restore_archived(transaction_id)
         for t in transactions:
             if t.get('id') == transaction_id:
                 t.update({'amount': int(new_data['amount']), 'source': new_data['source'], 'date': new_data['date']})
-                return self.save_data(transactions, settings)
+                if not self.save_data(transactions, settings, change={'op': 'transaction_updated', 'transaction': t}):
+                    return False
+                self.publish('transaction_updated', transaction=t)
+                return True
         return False
 
     def delete_transaction(self, transaction_id):
         transactions, settings = self.get_data()
+        if not any(t.get('id') == transaction_id for t in transactions):
+            transactions += self.restore_archived(transaction_id)
         initial_len = len(transactions)
         transactions = [t for t in transactions if t.get('id') != transaction_id]
         if len(transactions) < initial_len:
-            return self.save_data(transactions, settings)
+            if not self.save_data(transactions, settings, change={'op': 'transaction_deleted', 'transaction_id': transaction_id}):
+                return False
+            self.publish('transaction_deleted', transaction_id=transaction_id)
+            return True
         return False
 
+    @traced('get_profiles')
     def get_profiles(self):
         profiles = ['Default']
         if self.doc_ref:
-            try:
-                doc = self.doc_ref.get()
-                if doc.exists and doc.to_dict() is not None: 
-                    profiles.extend([p for p in doc.to_dict().get('profiles', {}).keys() if p != 'Default'])
-            except Exception as e: print(f"Firebase profiles error: {e}")
+            # Errors propagate: create_profile relies on this list to avoid overwriting a profile.
+            doc = cached_document(self.doc_ref)
+            if doc.exists and doc.to_dict() is not None: 
+                profiles.extend([p for p in doc.to_dict().get('profiles', {}).keys() if p != 'Default'])
         profiles.extend([p for p in session.get('profiles', {}).keys() if p not in profiles])
         return sorted(list(set(profiles)))
 
+# --- Password Hashing ---
+# PBKDF2 runs in a small per-process pool so a login storm queues a bounded amount of
+# work and is then shed with 503s, instead of every request thread hashing at once.
+# The request thread still waits for its hash, so each queued login holds a gunicorn
+# thread: logins hashing or waiting are capped to leave RESERVED_REQUEST_THREADS free.
+# Hashes keep Werkzeug's pbkdf2:sha256:<iterations>$salt$hash format, which the
+# Android WerkzeugPasswordHasher also reads.
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600000))
+PASSWORD_HASH_METHOD = f'pbkdf2:sha256:{PASSWORD_HASH_ITERATIONS}'
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+HASHING_RETRY_AFTER = 2
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool already has as many jobs running or waiting as it takes."""
+
+def hashing_slots():
+    slots = PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE
+    threads = request_threads()
+    if threads is None:
+        return slots
+    return max(1, min(slots, threads - RESERVED_REQUEST_THREADS))
+
+class HashingPool:
+    def __init__(self, workers, slots):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(slots)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self):
+        # Created on first use so each forked worker gets its own threads.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        future = self.executor().submit(fn, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn, *args):
+        """Runs fn in the pool and blocks the calling thread until it finishes."""
+        return self.submit(fn, *args).result()
+
+hashing_pool = HashingPool(PASSWORD_HASH_WORKERS, hashing_slots())
+
+def hash_password(password):
+    return hashing_pool.run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    return bool(password_hash) and hashing_pool.run(check_password_hash, password_hash, password)
+
+def password_hash_outdated(password_hash):
+    return password_hash.split('$', 1)[0] != PASSWORD_HASH_METHOD
+
+def rehash_password_later(user_id, password):
+    """Upgrades a stored hash to the current parameters off the request path; skipped when the pool is busy."""
+    def rehash():
+        try:
+            new_hash = generate_password_hash(password, PASSWORD_HASH_METHOD)
+            get_db().collection('users').document(user_id).update({'password_hash': new_hash})
+        except Exception as e:
+            print(f"Password rehash failed for {user_id}: {e}")
+    try:
+        hashing_pool.submit(rehash)
+    except HashingBusy:
+        pass
+
+def hashing_busy_response():
+    response = json_response({'success': False, 'error': 'Server is busy, please try again shortly'}, 503)
+    response.headers['Retry-After'] = str(HASHING_RETRY_AFTER)
+    return response
+
 # --- Auth Routes ---
 
-@app.route('/login')
+@bp.route('/login')
 def login():
     if 'user_id' in session:
         if session.get('role') == 'admin':
-            return redirect(url_for('admin_panel'))
-        return redirect(url_for('index'))
+            return redirect(url_for('.admin_panel'))
+        return redirect(url_for('.index'))
     return render_template('login.html')
 
-@app.route('/api/register', methods=['POST'])
+@bp.route('/api/register', methods=['POST'])
 def register():
-    if not db:
-        return jsonify({'success': False, 'error': 'Database not available'}), 500
+    if not get_db():
+        return json_response({'success': False, 'error': 'Database not available'}, 500)
         
     data = request.json
     username = data.get('username')
     password = data.get('password')
     
     if not username or not password:
-        return jsonify({'success': False, 'error': 'Username and password required'}), 400
-
-    users_ref = db.collection('users')
-    username_lower = username.lower()
-    if users_ref.where('username_lower', '==', username_lower).get():
-        return jsonify({'success': False, 'error': 'Username already exists'}), 409
-        
-    user_id = str(uuid.uuid4())
-    hashed_password = generate_password_hash(password)
-    users_ref.document(user_id).set({
-        'username': username,
-        'username_lower': username_lower,
-        'password_hash': hashed_password,
-        'created_at': dt_now_iso(),
-        'role': 'user'
-    })
-    return jsonify({'success': True})
+        return json_response({'success': False, 'error': 'Username and password required'}, 400)
 
-@app.route('/api/login', methods=['POST'])
+    try:
+        password_hash = hash_password(password)
+    except HashingBusy:
+        return hashing_busy_response()
+    if not create_user_account(username, password_hash):
+        return json_response({'success': False, 'error': 'Username already exists'}, 409)
+    return json_response({'success': True})
+
+@bp.route('/api/login', methods=['POST'])
 def handle_login():
-    if not db:
-        return jsonify({'success': False, 'error': 'Database not available'}), 500
+    if not get_db():
+        return json_response({'success': False, 'error': 'Database not available'}, 500)
 
     data = request.json
     username = data.get('username')
     password = data.get('password')
     
-    users_ref = db.collection('users')
-    
-    user_query = users_ref.where('username_lower', '==', username.lower()).limit(1).get()
-        
-    if not user_query:
-        return jsonify({'success': False, 'error': 'Invalid username or password'}), 401
+    user_doc = find_user_by_username(username) if username else None
+    if user_doc is None:
+        return json_response({'success': False, 'error': 'Invalid username or password'}, 401)
     
-    user_doc = user_query[0]
     user_data = user_doc.to_dict()
+    try:
+        password_ok = verify_password(user_data.get('password_hash'), password)
+    except HashingBusy:
+        return hashing_busy_response()
     
-    if check_password_hash(user_data.get('password_hash'), password):
+    if password_ok:
+        if password_hash_outdated(user_data['password_hash']):
+            rehash_password_later(user_doc.id, password)
+        regenerate_session()
         session.permanent = True
         session['user_id'] = user_doc.id
         session['username'] = user_data.get('username')
         session['role'] = user_data.get('role', 'user')
         
-        user_data_doc = db.collection('user_data').document(user_doc.id).get()
+        user_data_doc = get_db().collection('user_data').document(user_doc.id).get()
         last_profile = 'Default'
         
         if user_data_doc.exists and user_data_doc.to_dict() is not None:
@@ -463,53 +2614,90 @@ def handle_login():
         session['current_profile'] = last_profile
         
         if session['role'] == 'admin':
-            return jsonify({'success': True, 'username': session['username'], 'redirect': url_for('admin_panel')})
+            return json_response({'success': True, 'username': session['username'], 'redirect': url_for('.admin_panel')})
             
-        return jsonify({'success': True, 'username': session['username'], 'redirect': url_for('index')})
+        return json_response({'success': True, 'username': session['username'], 'redirect': url_for('.index')})
     else:
-        return jsonify({'success': False, 'error': 'Invalid username or password'}), 401
+        return json_response({'success': False, 'error': 'Invalid username or password'}, 401)
 
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 @login_required
 def logout():
     session.clear()
-    return jsonify({'success': True})
+    return json_response({'success': True})
 
-@app.route('/api/user')
-@login_required
-def get_user():
-    return jsonify({
+def current_user_payload():
+    return {
         'username': session.get('username'),
         'role': session.get('role', 'user'),
         'success': True
-    })
+    }
+
+@bp.route('/api/user')
+@login_required
+def get_user():
+    return json_response(current_user_payload())
+
+# --- Static Assets ---
+# build_assets.py writes minified copies of the static files to static/dist/ under
+# content-hashed names, plus a manifest. Templates link them through asset_url(), and
+# since a changed file gets a new name, browsers keep them for a year without asking
+# again. Without a manifest the plain files are linked instead.
+ASSET_MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist', 'manifest.json')
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def load_asset_manifest():
+    try:
+        with open(ASSET_MANIFEST_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+@bp.app_template_global()
+def asset_url(filename):
+    return url_for('static', filename=current_app.config['ASSET_MANIFEST'].get(filename, filename))
+
+@bp.after_app_request
+def cache_built_assets(response):
+    if request.endpoint == 'static' and request.view_args['filename'].startswith('dist/') and response.status_code < 400:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    return response
 
 # --- Main App Route ---
 
-@app.route('/')
+@bp.route('/')
 @login_required
 def index():
     return render_template('index.html')
 
 # --- Main Data API Routes ---
 
-@app.route('/api/data')
+@bp.route('/api/data')
 @login_required
 def get_all_data():
-    profile_name = session.get('current_profile', 'Default')
-    user_id = session.get('user_id')
-    tracker = WebCoinTracker(profile_name, user_id)
-    
+    tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
+    return json_response(dashboard_payload(tracker), etag=True)
+
+def dashboard_payload(tracker):
+    profile_name = tracker.profile_name
     transactions, settings = tracker.get_data()
     
+    # Archived transactions count through their index totals; the carry-forward entry holds their net.
+    archived = archive_summary(tracker.archive_chunks)
     balance = sum(t.get('amount', 0) for t in transactions)
+    transactions = [t for t in transactions if not is_archive_carry(t)]
     goal = settings.get('goal', 13500)
     today, week_start, month_start = datetime.now().date(), datetime.now().date() - timedelta(days=datetime.now().weekday()), datetime.now().date().replace(day=1)
     
     today_earn, week_earn, month_earn = 0, 0, 0
-    total_earnings = 0
+    total_earnings = archived['earned']
     first_earning_date = None
+    if archived['first_earning']:
+        first_earning_date = datetime.fromisoformat(archived['first_earning']).replace(tzinfo=timezone.utc)
     
     for t in transactions:
         if t.get('amount', 0) > 0:
@@ -546,26 +2734,30 @@ def get_all_data():
         elif avg_daily_earnings > 0:
             estimated_days = int(amount_remaining / avg_daily_earnings)
             
-    total_spending = abs(sum(t['amount'] for t in transactions if t['amount'] < 0))
+    total_spending = abs(sum(t['amount'] for t in transactions if t['amount'] < 0)) + archived['spent']
     
     earnings_breakdown = defaultdict(int)
+    spending_breakdown = defaultdict(int)
+    for source, totals in archived['sources'].items():
+        if totals['earned']: earnings_breakdown[source] += totals['earned']
+        if totals['spent']: spending_breakdown[source] += totals['spent']
+
     for t in transactions:
         if t['amount'] > 0: earnings_breakdown[t['source']] += t['amount']
         
-    spending_breakdown = defaultdict(int)
     for t in transactions:
         if t['amount'] < 0: spending_breakdown[t['source']] += abs(t['amount'])
         
-    timeline = [{'date': t['date'], 'balance': t.get('previous_balance', 0) + t.get('amount', 0)} for t in sorted(transactions, key=lambda x: x.get('date', ''))]
+    timeline = archived['timeline'] + [{'date': t['date'], 'balance': t.get('previous_balance', 0) + t.get('amount', 0)} for t in sorted(transactions, key=lambda x: x.get('date', ''))]
 
-    settings['firebase_available'] = FIREBASE_AVAILABLE and db is not None
+    settings['firebase_available'] = FIREBASE_AVAILABLE and get_db() is not None
     
-    all_sources = sorted(list(set(t['source'] for t in transactions)))
+    all_sources = sorted(list(set(t['source'] for t in transactions) | set(archived['sources'])))
     settings['all_sources'] = all_sources
 
-    achievements = calculate_achievements(transactions, balance, goal)
+    achievements = calculate_achievements(transactions, balance, goal, archived)
 
-    return jsonify({
+    return {
         'profile': profile_name, 
         'transactions': transactions, 
         'settings': settings, 
@@ -583,10 +2775,94 @@ def get_all_data():
             'timeline': timeline,
         },
         'achievements': achievements,
+        'version': tracker.journal_version,
+        'stale': tracker.loaded_stale,
         'success': True
-    })
-    
-@app.route('/api/history')
+    }
+
+@bp.route('/api/bootstrap')
+@login_required
+def bootstrap():
+    """Everything the dashboard needs on load in one response, with its Firestore reads issued together."""
+    profile_name = session.get('current_profile', 'Default')
+    user_id = session.get('user_id')
+    tracker = WebCoinTracker(profile_name, user_id)
+
+    if tracker.doc_ref:
+        try:
+            seed_document_cache(storage_call(read_documents, [f'user_data/{user_id}', 'app_config/broadcast']))
+        except StorageUnavailable:
+            pass # get_data serves the stale copy, or reports the outage
+
+    data = dashboard_payload(tracker)
+    profiles = [profile_name] if tracker.loaded_stale else tracker.get_profiles()
+    return json_response({
+        'data': data,
+        'profiles': {'profiles': profiles, 'current_profile': profile_name},
+        'user': current_user_payload(),
+        'broadcast': broadcast_payload(),
+        'success': True,
+    }, etag=True)
+
+# --- Request Batching ---
+# POST /api/batch answers several GET API calls in one round trip. Sub-requests run
+# inside the batch's app context, so they share its session and its document cache:
+# /api/bootstrap and /api/history in one batch read the user's document once. Each
+# sub-request is rate limited as if it had been sent on its own.
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', 10))
+# Streaming responses can't be embedded in a JSON reply, and batches don't nest.
+BATCH_EXCLUDED_ENDPOINTS = {f'{bp.name}.{name}' for name in ('batch_requests', 'stream_events', 'export_transactions')}
+
+def run_subrequest(path, etag=None):
+    """Dispatches one batched GET and returns (status, JSON body, ETag); the body is None for a 304."""
+    headers = {
+        'X-Requested-With': 'XMLHttpRequest',
+        'X-Client-Id': request.headers.get('X-Client-Id', ''),
+    }
+    if etag:
+        headers['If-None-Match'] = etag
+    builder = EnvironBuilder(path=path, base_url=request.url_root, method='GET', headers=headers)
+    context = current_app.request_context(builder.get_environ())
+    context.session = session._get_current_object()
+    g.in_subrequest = True
+    try:
+        with context:
+            if not request.path.startswith('/api/') or request.endpoint in BATCH_EXCLUDED_ENDPOINTS:
+                return 400, {'success': False, 'error': f'{request.path} cannot be batched'}, None
+            try:
+                rv = enforce_rate_limit() or current_app.dispatch_request()
+            except Exception as e:
+                rv = current_app.handle_user_exception(e)
+            response = current_app.make_response(rv)
+            if response.status_code == 304:
+                return 304, None, response.headers.get('ETag')
+            body = response.get_json(silent=True)
+            if body is None:
+                return max(response.status_code, 400), {'success': False, 'error': f'{request.path} did not return JSON'}, None
+            return response.status_code, body, response.headers.get('ETag')
+    except Exception as e:
+        print(f"Batched request to {path} failed: {e}")
+        return 500, {'success': False, 'error': 'Internal server error'}, None
+    finally:
+        g.in_subrequest = False
+
+@bp.route('/api/batch', methods=['POST'])
+@login_required
+def batch_requests():
+    subrequests = (request.get_json(silent=True) or {}).get('requests')
+    if not isinstance(subrequests, list) or not all(isinstance(r, dict) and isinstance(r.get('path'), str) for r in subrequests):
+        return json_response({'success': False, 'error': 'Expected {"requests": [{"path": ..., "etag": ...}, ...]}'}, 400)
+    if len(subrequests) > BATCH_MAX_REQUESTS:
+        return json_response({'success': False, 'error': f'At most {BATCH_MAX_REQUESTS} requests per batch'}, 400)
+
+    responses = []
+    for sub in subrequests:
+        etag = sub.get('etag') if isinstance(sub.get('etag'), str) else None
+        status, body, etag = run_subrequest(sub['path'], etag)
+        responses.append({'path': sub['path'], 'status': status, 'body': body, 'etag': etag})
+    return json_response({'responses': responses, 'success': True})
+
+@bp.route('/api/history')
 @login_required
 def get_history_paginated():
     profile_name = session.get('current_profile', 'Default')
@@ -609,34 +2885,155 @@ def get_history_paginated():
     filters = {k: v for k, v in filters.items() if v}
         
     data = tracker.get_transactions_paginated(page, limit, filters)
-    return jsonify(data)
+    return json_response(data)
+
+@bp.route('/api/changes')
+@login_required
+def get_profile_changes():
+    """The current profile's journal after ?since=<version>, for clients that sync incrementally."""
+    tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return json_response({'success': False, 'error': 'since must be a version number'}, 400)
+    return json_response({'profile': tracker.profile_name, **tracker.get_changes(since), 'success': True})
 
-@app.route('/api/add-transaction', methods=['POST'])
+@bp.route('/api/events')
+@login_required
+def stream_events():
+    """Server-Sent Events stream of the signed-in user's changes and admin broadcasts."""
+    if not sse_slots.acquire(blocking=False):
+        response = json_response({'success': False, 'error': 'Too many live connections'}, 503)
+        response.headers['Retry-After'] = str(SSE_RETRY_MS // 1000)
+        return response
+    channels = [f"user:{session['user_id']}", 'broadcast']
+    events = event_bus.subscribe(channels)
+
+    def stream():
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        closes_at = time.monotonic() + SSE_MAX_SECONDS
+        while time.monotonic() < closes_at:
+            try:
+                event = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ': keepalive\n\n' # also how a dropped client is noticed
+                continue
+            yield format_sse(event)
+
+    def close():
+        event_bus.unsubscribe(events, channels)
+        sse_slots.release()
+
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs however the stream ends, including a client that leaves before the first byte.
+    response.call_on_close(close)
+    return response
+
+# --- Export Routes ---
+
+EXPORT_PAGE_SIZE = 500
+EXPORT_CSV_FIELDS = ['id', 'date', 'amount', 'source', 'previous_balance', 'balance']
+
+def _export_ndjson(pages):
+    for page in pages:
+        yield ''.join(json.dumps(t, ensure_ascii=False) + '\n' for t in page)
+
+def _export_csv(pages):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_FIELDS)
+    for page in pages:
+        for t in page:
+            writer.writerow([
+                t.get('id', ''), t.get('date', ''), t.get('amount', 0), t.get('source', ''),
+                t.get('previous_balance', 0), t.get('previous_balance', 0) + t.get('amount', 0)
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+def export_content_disposition(filename):
+    """An attachment header safe for any profile name: an ASCII filename, plus the exact one per RFC 5987."""
+    fallback = ''.join(c if c.isascii() and (c.isalnum() or c in '._-') else '_' for c in filename)
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+def _gzip_stream(chunks):
+    # Sync-flush after every page so the client keeps receiving bytes on long exports.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+@bp.route('/api/export')
+@login_required
+def export_transactions():
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return json_response({'success': False, 'error': 'Format must be ndjson or csv'}, 400)
+
+    try:
+        date_from = date.fromisoformat(request.args['date_from']) if request.args.get('date_from') else None
+        date_to = date.fromisoformat(request.args['date_to']) if request.args.get('date_to') else None
+    except ValueError:
+        return json_response({'success': False, 'error': 'Dates must be YYYY-MM-DD'}, 400)
+
+    profile_name = session.get('current_profile', 'Default')
+    tracker = WebCoinTracker(profile_name, session.get('user_id'))
+    pages = tracker.iter_transaction_pages(EXPORT_PAGE_SIZE, date_from, date_to)
+
+    if export_format == 'csv':
+        body, mimetype = _export_csv(pages), 'text/csv'
+    else:
+        body, mimetype = _export_ndjson(pages), 'application/x-ndjson'
+
+    headers = {
+        'Content-Disposition': export_content_disposition(
+            f'coin_tracker_export_{profile_name}_{date.today().isoformat()}.{export_format}'),
+        'Vary': 'Accept-Encoding',
+    }
+    if 'gzip' in request.accept_encodings:
+        body = _gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = (chunk.encode('utf-8') for chunk in body)
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+@bp.route('/api/add-transaction', methods=['POST'])
 @login_required
 def handle_add_transaction():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
     data = request.json
     if tracker.add_transaction(data['amount'], data['source'], data['date']):
         return get_all_data()
-    return jsonify({'success': False, 'error': 'Failed to save transaction'}), 500
+    return json_response({'success': False, 'error': 'Failed to save transaction'}, 500)
+
+def archive_carry_response():
+    # The row stands for the archived transactions and is rebuilt from them on every load.
+    return json_response({'success': False, 'error': 'The archived balance can only change through the transactions it sums up'}, 400)
 
-@app.route('/api/update-transaction/<transaction_id>', methods=['POST'])
+@bp.route('/api/update-transaction/<transaction_id>', methods=['POST'])
 @login_required
 def handle_update_transaction(transaction_id):
+    if transaction_id == ARCHIVE_CARRY_ID:
+        return archive_carry_response()
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
     if tracker.update_transaction(transaction_id, request.json):
         return get_all_data()
-    return jsonify({'success': False, 'error': 'Failed to update'}), 404
+    return json_response({'success': False, 'error': 'Failed to update'}, 404)
 
-@app.route('/api/delete-transaction/<transaction_id>', methods=['POST'])
+@bp.route('/api/delete-transaction/<transaction_id>', methods=['POST'])
 @login_required
 def handle_delete_transaction(transaction_id):
+    if transaction_id == ARCHIVE_CARRY_ID:
+        return archive_carry_response()
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
     if tracker.delete_transaction(transaction_id):
         return get_all_data()
-    return jsonify({'success': False, 'error': 'Failed to delete'}), 404
+    return json_response({'success': False, 'error': 'Failed to delete'}, 404)
 
-@app.route('/api/update-settings', methods=['POST'])
+@bp.route('/api/update-settings', methods=['POST'])
 @login_required
 def update_settings():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
@@ -644,20 +3041,21 @@ def update_settings():
     
     settings.update(request.json)
     
-    if tracker.save_data(transactions, settings):
+    if tracker.save_data(transactions, settings, change={'op': 'settings_changed', 'settings': settings}):
+        tracker.publish('settings_changed', settings=settings)
         return get_all_data()
-    return jsonify({'success': False, 'error': 'Failed to save settings'}), 500
+    return json_response({'success': False, 'error': 'Failed to save settings'}, 500)
     
-@app.route('/api/import-data', methods=['POST'])
+@bp.route('/api/import-data', methods=['POST'])
 @login_required
 def handle_import_data():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
     data = request.json
     if tracker.import_data(data):
         return get_all_data()
-    return jsonify({'success': False, 'error': 'Failed to import data'}), 500
+    return json_response({'success': False, 'error': 'Failed to import data'}, 500)
 
-@app.route('/api/add-quick-action', methods=['POST'])
+@bp.route('/api/add-quick-action', methods=['POST'])
 @login_required
 def add_quick_action():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
@@ -666,12 +3064,13 @@ def add_quick_action():
     new_action = request.json
     if 'text' in new_action and 'value' in new_action and 'is_positive' in new_action:
         settings['quick_actions'].append(new_action)
-        if tracker.save_data(transactions, settings):
+        if tracker.save_data(transactions, settings, change={'op': 'settings_changed', 'settings': settings}):
+            tracker.publish('settings_changed', settings=settings)
             return get_all_data()
     
-    return jsonify({'success': False, 'error': 'Invalid action data'}), 400
+    return json_response({'success': False, 'error': 'Invalid action data'}, 400)
 
-@app.route('/api/delete-quick-action', methods=['POST'])
+@bp.route('/api/delete-quick-action', methods=['POST'])
 @login_required
 def delete_quick_action():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
@@ -684,35 +3083,36 @@ def delete_quick_action():
         index_to_delete = int(index_to_delete)
         if 0 <= index_to_delete < len(settings['quick_actions']):
             settings['quick_actions'].pop(index_to_delete)
-            if tracker.save_data(transactions, settings):
+            if tracker.save_data(transactions, settings, change={'op': 'settings_changed', 'settings': settings}):
+                tracker.publish('settings_changed', settings=settings)
                 return get_all_data()
     except (TypeError, ValueError):
         pass 
     
-    return jsonify({'success': False, 'error': 'Invalid index'}), 400
+    return json_response({'success': False, 'error': 'Invalid index'}, 400)
 
 # --- Profile Routes ---
-@app.route('/api/profiles')
+@bp.route('/api/profiles')
 @login_required
 def get_profiles():
     tracker = WebCoinTracker(user_id=session.get('user_id'))
-    return jsonify({'profiles': tracker.get_profiles(), 'current_profile': session.get('current_profile', 'Default')})
+    return json_response({'profiles': tracker.get_profiles(), 'current_profile': session.get('current_profile', 'Default')})
 
-@app.route('/api/switch-profile', methods=['POST'])
+@bp.route('/api/switch-profile', methods=['POST'])
 @login_required
 def switch_profile():
     profile_name = request.json.get('profile_name')
     user_id = session.get('user_id')
     session['current_profile'] = profile_name
     
-    if db and FIREBASE_AVAILABLE:
+    if get_db() and FIREBASE_AVAILABLE:
         try:
-            db.collection('user_data').document(user_id).set({'last_active_profile': profile_name}, merge=True)
+            get_db().collection('user_data').document(user_id).set({'last_active_profile': profile_name}, merge=True)
         except Exception as e: print(f"Error saving last active profile: {e}")
             
-    return jsonify({'success': True})
+    return json_response({'success': True})
 
-@app.route('/api/create-profile', methods=['POST'])
+@bp.route('/api/create-profile', methods=['POST'])
 @login_required
 def create_profile():
     profile_name = request.json.get('profile_name')
@@ -720,194 +3120,366 @@ def create_profile():
     
     tracker = WebCoinTracker(profile_name, user_id)
     if profile_name in tracker.get_profiles():
-        return jsonify({'success': False, 'error': 'Profile already exists'}), 409
+        return json_response({'success': False, 'error': 'Profile already exists'}, 409)
         
-    if tracker.save_data([], tracker.get_default_settings()):
+    if tracker.save_data([], tracker.get_default_settings(), change={'op': 'profile_created'}):
+        tracker.publish('profile_created')
         session['current_profile'] = profile_name
-        if db and FIREBASE_AVAILABLE:
+        if get_db() and FIREBASE_AVAILABLE:
             try:
-                db.collection('user_data').document(user_id).set({'last_active_profile': profile_name}, merge=True)
+                get_db().collection('user_data').document(user_id).set({'last_active_profile': profile_name}, merge=True)
             except Exception as e: print(f"Error saving last active profile: {e}")
         
-        return jsonify({
+        return json_response({
             'success': True, 
             'profiles': tracker.get_profiles(), 
             'current_profile': profile_name
         })
-    return jsonify({'success': False, 'error': 'Failed to create profile'}), 500
+    return json_response({'success': False, 'error': 'Failed to create profile'}, 500)
 
 # --- Admin Routes ---
 
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin_panel():
     if session.get('role') != 'admin':
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template('admin.html')
 
-@app.route('/api/admin/stats')
+@bp.route('/api/admin/stats')
 @admin_required
 def get_admin_stats():
-    total_users = len(list(db.collection('users').stream()))
-    
-    thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    users_query = db.collection('users').where('created_at', '>=', thirty_days_ago.isoformat()).stream()
-    
-    signups_by_day = defaultdict(int)
-    for user in users_query:
-        try:
-            created_at_str = user.to_dict().get('created_at')
-            if '+' in created_at_str or 'Z' in created_at_str:
-                day = datetime.fromisoformat(created_at_str).strftime('%Y-%m-%d')
-            else:
-                day = datetime.fromisoformat(created_at_str + '+00:00').strftime('%Y-%m-%d')
-            signups_by_day[day] += 1
-        except Exception:
-            pass 
-
-    chart_labels = []
-    chart_data = []
-    for i in range(30):
-        day = (datetime.now(timezone.utc) - timedelta(days=i)).strftime('%Y-%m-%d')
-        chart_labels.append(day)
-        chart_data.append(signups_by_day[day])
-        
-    chart_labels.reverse()
-    chart_data.reverse()
-
-    total_coins = 0
-    total_transactions = 0
-    all_user_data = db.collection('user_data').stream()
-    for user_data_doc in all_user_data:
-        doc_data = user_data_doc.to_dict()
-        if doc_data is None:
-            continue
-            
-        profiles = doc_data.get('profiles', {})
-        
-        if profiles:
-            for profile in profiles.values():
-                txns = profile.get('transactions', [])
-                total_transactions += len(txns)
-                for t in txns:
-                    total_coins += t.get('amount', 0)
-        elif 'transactions' in doc_data:
-             txns = doc_data.get('transactions', [])
-             total_transactions += len(txns)
-             for t in txns:
-                total_coins += t.get('amount', 0)
-                
-    return jsonify({
-        'stats': {
-            'total_users': total_users,
-            'total_coins': total_coins,
-            'total_transactions': total_transactions
-        },
-        'chart_data': {
-            'labels': chart_labels,
-            'data': chart_data
-        },
+    snapshot = None if request.args.get('refresh') == '1' else load_admin_snapshot()
+    if snapshot is None:
+        snapshot = store_admin_snapshot()
+
+    age = snapshot_age_seconds(snapshot)
+    return json_response({
+        **snapshot['data'],
+        'generated_at': snapshot['generated_at'],
+        'age_seconds': int(age),
+        'stale': age > 2 * max(ADMIN_SNAPSHOT_INTERVAL, 1),
         'success': True
     })
 
-@app.route('/api/admin/users')
+@bp.route('/api/admin/stats/reconcile', methods=['POST'])
 @admin_required
-def get_admin_users():
-    users_ref = db.collection('users')
-    data_ref = db.collection('user_data')
-    
-    users_query = users_ref.order_by('username_lower').stream()
-    users_dict = {}
-    for user in users_query:
-        user_data = user.to_dict()
-        users_dict[user.id] = {
-            'user_id': user.id,
-            'username': user_data.get('username', 'N/A'),
-            'created_at': user_data.get('created_at', 'N/A'),
-            'balance': 0,
-            'last_updated': 'N/A',
-            'txn_count': 0
-        }
-        
-    all_user_data = data_ref.stream()
-    for user_data_doc in all_user_data:
-        user_id = user_data_doc.id
-        if user_id in users_dict:
-            doc_data = user_data_doc.to_dict()
-            if doc_data is None:
-                continue
+def reconcile_admin_stats_route():
+    try:
+        counters = reconcile_admin_stats()
+        store_admin_snapshot()
+        return json_response({'success': True, 'stats': counters})
+    except Exception as e:
+        return json_response({'success': False, 'error': str(e)}, 500)
 
-            user_balance = 0
-            user_txn_count = 0
-            last_updated = 'N/A'
-            
-            if 'profiles' in doc_data:
-                profiles = doc_data.get('profiles', {})
-                for profile in profiles.values():
-                    txns = profile.get('transactions', [])
-                    user_txn_count += len(txns)
-                    for t in txns:
-                        user_balance += t.get('amount', 0)
-                    
-                    profile_last_updated = profile.get('last_updated')
-                    if profile_last_updated:
-                        if last_updated == 'N/A' or profile_last_updated > last_updated:
-                            last_updated = profile_last_updated
-            
-            elif 'transactions' in doc_data:
-                txns = doc_data.get('transactions', [])
-                user_txn_count = len(txns)
-                for t in txns:
-                    user_balance += t.get('amount', 0)
+@bp.route('/api/admin/metrics')
+@admin_required
+def get_admin_metrics():
+    if request.args.get('format') == 'prometheus' or request.accept_mimetypes.best == 'text/plain':
+        return Response(render_prometheus_metrics(), mimetype='text/plain; version=0.0.4')
+
+    with route_metrics_lock:
+        routes = [
+            {'method': method, 'route': route, **metrics.to_dict()}
+            for (method, route), metrics in sorted(route_metrics.items())
+        ]
+    breaker = {'state': storage_breaker.state, 'consecutive_failures': storage_breaker.failures}
+    return json_response({'routes': routes, 'storage_breaker': breaker, 'pid': os.getpid(), 'success': True})
 
-            users_dict[user_id]['balance'] = user_balance
-            users_dict[user_id]['txn_count'] = user_txn_count
-            users_dict[user_id]['last_updated'] = last_updated
+@bp.route('/api/admin/profiling')
+@admin_required
+def get_profile_reports():
+    return json_response({'reports': list(reversed(profile_reports)), 'success': True})
+
+ADMIN_USER_SORT_FIELDS = {
+    'username': 'username_lower',
+    'balance': 'balance',
+    'txn_count': 'txn_count',
+    'last_updated': 'last_updated',
+    'created_at': 'created_at',
+}
+ADMIN_USER_SUMMARY_FIELDS = ['username', 'balance', 'txn_count', 'last_updated', 'created_at']
+ADMIN_USERS_PAGE_MAX = 100
+
+@bp.route('/api/admin/users')
+@admin_required
+def get_admin_users():
+    sort = request.args.get('sort', 'username')
+    if sort not in ADMIN_USER_SORT_FIELDS:
+        return json_response({'success': False, 'error': 'Unknown sort column'}, 400)
+    direction = firestore.Query.DESCENDING if request.args.get('direction') == 'desc' else firestore.Query.ASCENDING
+    try:
+        limit = max(1, min(int(request.args.get('limit', 25)), ADMIN_USERS_PAGE_MAX))
+    except ValueError:
+        limit = 25
+
+    summaries_ref = get_db().collection('user_summaries')
+    query = summaries_ref.select(ADMIN_USER_SUMMARY_FIELDS)
+
+    search = request.args.get('q', '').strip().lower()
+    if search:
+        # Prefix match as a range on the single-field username_lower index; Firestore
+        # requires the first ordering to be on the range field, so searches sort by name.
+        sort = 'username'
+        query = query.where('username_lower', '>=', search).where('username_lower', '<', search + '\uf8ff')
+    query = query.order_by(ADMIN_USER_SORT_FIELDS[sort], direction=direction)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        cursor_doc = summaries_ref.document(cursor).get()
+        if not cursor_doc.exists:
+            return json_response({'success': False, 'error': 'Invalid cursor'}, 400)
+        query = query.start_after(cursor_doc)
+
+    docs = list(query.limit(limit + 1).stream())
+    users = []
+    for doc in docs[:limit]:
+        summary = doc.to_dict() or {}
+        users.append({
+            'user_id': doc.id,
+            'username': summary.get('username', 'N/A'),
+            'created_at': summary.get('created_at') or 'N/A',
+            'balance': summary.get('balance', 0),
+            'last_updated': summary.get('last_updated') or 'N/A',
+            'txn_count': summary.get('txn_count', 0),
+        })
 
-    return jsonify({'users': list(users_dict.values()), 'success': True})
+    return json_response({
+        'users': users,
+        'next_cursor': users[-1]['user_id'] if len(docs) > limit else None,
+        'sort': sort,
+        'success': True
+    })
 
 
-@app.route('/api/admin/delete-user', methods=['POST'])
+@bp.route('/api/admin/delete-user', methods=['POST'])
 @admin_required
 def delete_admin_user():
     user_id = request.json.get('user_id')
     if not user_id:
-        return jsonify({'success': False, 'error': 'User ID required'}), 400
-    
+        return json_response({'success': False, 'error': 'User ID required'}, 400)
+
+    try:
+        job_id = start_delete_job([user_id], session.get('username'))
+        return json_response({'success': True, 'job_id': job_id}, 202)
+    except Exception as e:
+        return json_response({'success': False, 'error': str(e)}, 500)
+
+@bp.route('/api/admin/delete-users', methods=['POST'])
+@admin_required
+def delete_admin_users():
+    user_ids = list(dict.fromkeys(request.json.get('user_ids') or []))
+    if not user_ids:
+        return json_response({'success': False, 'error': 'User IDs required'}, 400)
+    if len(user_ids) > DELETE_JOB_MAX_USERS:
+        return json_response({'success': False, 'error': f'At most {DELETE_JOB_MAX_USERS} users per job'}, 400)
+
     try:
-        db.collection('users').document(user_id).delete()
-        db.collection('user_data').document(user_id).delete()
-        return jsonify({'success': True})
+        job_id = start_delete_job(user_ids, session.get('username'))
+        return json_response({'success': True, 'job_id': job_id}, 202)
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return json_response({'success': False, 'error': str(e)}, 500)
+
+@bp.route('/api/admin/jobs/<job_id>')
+@admin_required
+def get_admin_job(job_id):
+    doc = get_db().collection('admin_jobs').document(job_id).get()
+    if not doc.exists:
+        return json_response({'success': False, 'error': 'Job not found'}, 404)
+    return json_response({'job': describe_job(job_id, doc.to_dict()), 'success': True})
+
+@bp.route('/api/admin/jobs/<job_id>/resume', methods=['POST'])
+@admin_required
+def resume_admin_job(job_id):
+    doc = get_db().collection('admin_jobs').document(job_id).get()
+    if not doc.exists:
+        return json_response({'success': False, 'error': 'Job not found'}, 404)
+
+    job = describe_job(job_id, doc.to_dict())
+    if job['status'] not in ('interrupted', 'failed', 'completed_with_errors'):
+        return json_response({'success': False, 'error': f"Job is {job['status']}"}, 409)
+
+    submit_job(job_id)
+    return json_response({'success': True, 'job_id': job_id}, 202)
 
 # --- Broadcast Routes ---
 
-@app.route('/api/broadcast')
+@bp.route('/api/broadcast')
 @login_required 
 def get_broadcast():
+    return json_response(broadcast_payload())
+
+def broadcast_payload():
     try:
-        doc = db.collection('app_config').document('broadcast').get()
+        doc = cached_document(get_db().collection('app_config').document('broadcast'))
         if doc.exists:
-            return jsonify(doc.to_dict())
-        return jsonify({'message': ''})
+            return doc.to_dict()
     except Exception:
-        return jsonify({'message': ''})
+        pass
+    return {'message': ''}
 
-@app.route('/api/admin/broadcast', methods=['POST'])
+@bp.route('/api/admin/broadcast', methods=['POST'])
 @admin_required
 def set_broadcast():
     message = request.json.get('message', '')
     try:
-        db.collection('app_config').document('broadcast').set({
+        get_db().collection('app_config').document('broadcast').set({
             'message': message,
             'set_by': session.get('username'),
             'set_at': dt_now_iso()
         })
-        return jsonify({'success': True})
+        publish_event('broadcast', 'broadcast_changed', message=message)
+        return json_response({'success': True})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
-
+        return json_response({'success': False, 'error': str(e)}, 500)
+
+
+# --- Server-Side Sessions ---
+# With SESSION_BACKEND=sqlite the session cookie carries only a random id and the
+# session itself lives in SQLite, so offline-mode profiles kept in the session don't
+# travel with (or overflow) every request. One file per instance, shared by its workers.
+# It is the default only where sessions outlive a restart anyway: when SESSION_DB_PATH
+# points at persistent storage, or in offline mode. Otherwise (e.g. on Render, whose
+# disk is wiped on every deploy and restart) Flask's signed-cookie sessions are kept.
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH')
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or \
+    ('sqlite' if SESSION_DB_PATH or not firebase_configured() else 'cookie')
+SESSION_DB_PATH = SESSION_DB_PATH or os.path.join(tempfile.gettempdir(), 'coin_tracker_sessions.sqlite3')
+SESSION_MAX_BYTES = int(os.environ.get('SESSION_MAX_BYTES', 1024 * 1024))
+# Room left in the browser's 4 KB cookie limit once the cookie's name and attributes are added.
+COOKIE_SESSION_MAX_BYTES = 3800
+SESSION_PURGE_INTERVAL = 600
+# A session's expiry is pushed back at most this often, not on every request.
+SESSION_TOUCH_INTERVAL = timedelta(hours=1)
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = sid is None
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Moves the session to a new id when it is next saved; the old one is deleted."""
+        self.replaced_sid = self.replaced_sid or self.sid
+        self.sid = None
+        self.new = True
+        self.modified = True
+
+class SqliteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.next_purge = 0
+
+    def connection(self):
+        # sqlite3 connections can't cross threads (or forks), so each thread opens its own.
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            row = self.connection().execute('SELECT data, expires FROM sessions WHERE sid = ?', (sid,)).fetchone()
+            if row and row[1] > time.time():
+                expires = datetime.fromtimestamp(row[1], timezone.utc)
+                return ServerSideSession(self.serializer.loads(row[0]), sid=sid, expires=expires)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+        if session.replaced_sid:
+            self.connection().execute('DELETE FROM sessions WHERE sid = ?', (session.replaced_sid,))
+        if not session:
+            if session.sid and session.modified:
+                self.connection().execute('DELETE FROM sessions WHERE sid = ?', (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = datetime.now(timezone.utc)
+        expires = now + app.permanent_session_lifetime
+        touch = session.expires is None or session.expires - now < app.permanent_session_lifetime - SESSION_TOUCH_INTERVAL
+        if not (session.modified or session.new or touch):
+            return
+
+        sid = session.sid or secrets.token_urlsafe(32)
+        if session.modified or session.new:
+            data = self.serializer.dumps(dict(session))
+            if len(data) > self.max_bytes:
+                print(f"Session {sid[:8]}... is {len(data)} bytes, over SESSION_MAX_BYTES; not saved.")
+                return
+            self.connection().execute('INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                                      (sid, data, expires.timestamp()))
+        else:
+            self.connection().execute('UPDATE sessions SET expires = ? WHERE sid = ?', (expires.timestamp(), sid))
+        self.purge_expired()
+
+        response.set_cookie(
+            name, sid,
+            expires=expires if session.permanent else None,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def purge_expired(self):
+        if time.monotonic() >= self.next_purge:
+            self.next_purge = time.monotonic() + SESSION_PURGE_INTERVAL
+            self.connection().execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),))
+
+def regenerate_session():
+    """Starts a fresh session under a new id, so an id obtained before sign-in can't ride along into it."""
+    session.clear()
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+def session_fits(data):
+    """Whether a session holding data stays under its backend's size limit once stored."""
+    if SESSION_BACKEND == 'sqlite':
+        return len(SqliteSessionInterface.serializer.dumps(data)) <= SESSION_MAX_BYTES
+    # Signed-cookie sessions: browsers drop a cookie over about 4 KB instead of storing it.
+    serializer = current_app.session_interface.get_signing_serializer(current_app)
+    return len(serializer.dumps(dict(data))) <= COOKIE_SESSION_MAX_BYTES
+
+# --- Health Check ---
+
+@bp.route('/healthz')
+def healthz():
+    # Answers from the process alone: a cold start is healthy before Firestore connects.
+    return json_response({'status': 'ok', 'storage_connected': _db_ready and db is not None})
+
+# --- App Factory ---
+
+def create_app():
+    """Builds the Flask app. Storage connects lazily on first use, so this stays cheap."""
+    app = Flask(__name__,
+        template_folder='templates',
+        static_folder='static'
+    )
+    app.secret_key = os.environ.get('SECRET_KEY', 'a-very-secret-key-for-dev')
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+    app.config['ASSET_MANIFEST'] = load_asset_manifest()
+    if SESSION_BACKEND == 'sqlite':
+        app.session_interface = SqliteSessionInterface(SESSION_DB_PATH, SESSION_MAX_BYTES)
+    app.register_blueprint(bp)
+    return app
+
+app = create_app()
 
 # --- Main Entry Point ---
 
@@ -0,0 +1,79 @@
+"""Cold-start benchmark: how long from launch until the app answers.
+
+For each run it measures, in a fresh process:
+  import      time to import the app module (python -c "import app")
+  healthz     gunicorn launch until the first byte of /healthz (no Firestore needed)
+  first page  launch until the first byte of /login, which also connects to Firestore
+
+    cd web
+    python benchmark_startup.py --runs 5
+
+Reports the median and the best of the runs.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+from loadtest import free_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import():
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)'],
+        cwd=HERE, stderr=subprocess.DEVNULL, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def first_byte(url, launched, process):
+    while True:
+        if process.poll() is not None:
+            raise SystemExit(f'gunicorn exited with status {process.returncode}')
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                response.read(1)
+            return time.perf_counter() - launched
+        except OSError:
+            time.sleep(0.01)
+
+
+def time_server():
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WEB_CONCURRENCY='1')
+    launched = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                               env=env, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        healthz = first_byte(f'http://127.0.0.1:{port}/healthz', launched, process)
+        # Measured from launch too, so it includes the lazy Firestore connection.
+        first_page = first_byte(f'http://127.0.0.1:{port}/login', launched, process)
+        return healthz, first_page
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {'import': [], 'healthz': [], 'first page': []}
+    for _ in range(args.runs):
+        results['import'].append(time_import())
+        healthz, first_page = time_server()
+        results['healthz'].append(healthz)
+        results['first page'].append(first_page)
+
+    print(f"{'measure':<12} {'median s':>9} {'best s':>9}")
+    for name, samples in results.items():
+        print(f"{name:<12} {statistics.median(samples):>9.3f} {min(samples):>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Startup time and throughput of each gunicorn worker class.
+
+Starts the app under gunicorn.conf.py once per worker class, records how long it
+takes from launch until the first response, then loads one endpoint with concurrent
+clients and reports throughput and latency.
+
+    cd web
+    python benchmark_workers.py                       # /login, no Firestore needed
+    python benchmark_workers.py --path /api/bootstrap --username demo --password secret
+
+gevent is skipped unless it is installed.
+"""
+import os
+import sys
+import time
+import argparse
+import importlib.util
+import subprocess
+import urllib.request
+
+from loadtest import format_result, free_port, login, run_load
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+
+
+def start(worker_class, workers):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers),
+               RATE_LIMIT_READS='off', RATE_LIMIT_AUTH='off')
+    launched = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                               env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    while True:
+        if process.poll() is not None:
+            raise SystemExit(f'gunicorn ({worker_class}) exited with status {process.returncode}')
+        try:
+            urllib.request.urlopen(f'{base_url}/login', timeout=2).read()
+            return process, base_url, time.perf_counter() - launched
+        except Exception:
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default='/login', help='Endpoint to load (default: %(default)s)')
+    parser.add_argument('--username', help='Account to sign in with, for /api/ endpoints')
+    parser.add_argument('--password')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15, help='Seconds per worker class')
+    args = parser.parse_args()
+
+    print(f"{'class':<10} {'startup s':>9} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for worker_class in WORKER_CLASSES:
+        if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print(f"{worker_class:<10} skipped (pip install gevent)")
+            continue
+        process, base_url, startup = start(worker_class, args.workers)
+        try:
+            if args.username:
+                opener = login(base_url, args.username, args.password)
+            else:
+                opener = urllib.request.build_opener()
+            result = run_load(base_url, opener, args.path, args.concurrency, args.duration)
+            print(f"{worker_class:<10} {startup:>9.2f} {format_result(result)}")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
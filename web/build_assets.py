@@ -0,0 +1,215 @@
+"""Builds fingerprinted static assets for production.
+
+Minifies static/css/*.css and static/js/*.js, copies static/images/* as they are, and
+writes each file to static/dist/ under a name that includes a hash of its content,
+plus static/dist/manifest.json mapping the original paths to the built ones:
+
+    cd web
+    python build_assets.py
+
+The app's asset_url() template helper reads the manifest at startup, and responses
+for static/dist/ are cached by browsers for a year without revalidation, since a
+changed file gets a new name. Without a manifest (e.g. in development) templates get
+the plain, unversioned files. Needs nothing beyond the standard library.
+"""
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(HERE, 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+SOURCE_DIRS = ('css', 'js', 'images')
+
+# Characters after which a "/" starts a regular expression rather than a division.
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'delete', 'void', 'throw', 'new')
+
+
+def _read_quoted(source, i, out):
+    """Copies the string literal starting at source[i] to out; returns the index after it."""
+    quote = source[i]
+    j = i + 1
+    while j < len(source) and source[j] != quote:
+        j += 2 if source[j] == '\\' else 1
+    out.append(source[i:j + 1])
+    return j + 1
+
+
+def _starts_regex(out):
+    code = ''.join(out[-20:]).rstrip()
+    if not code or code[-1] in REGEX_PRECEDERS:
+        return True
+    return re.search(r'(?:^|[^\w$])(?:%s)$' % '|'.join(REGEX_KEYWORDS), code) is not None
+
+
+def _read_regex(source, i, out):
+    j, in_class = i + 1, False
+    while j < len(source) and (in_class or source[j] != '/'):
+        if source[j] == '\\':
+            j += 1
+        elif source[j] == '[':
+            in_class = True
+        elif source[j] == ']':
+            in_class = False
+        j += 1
+    out.append(source[i:j + 1])
+    return j + 1
+
+
+def _end_line(source, i, out):
+    """Ends the output line without trailing spaces or blank lines; returns the index past the next line's indentation."""
+    while out and out[-1] in (' ', '\t'):
+        out.pop()
+    if out and out[-1] != '\n':
+        out.append('\n')
+    while i < len(source) and source[i] in ' \t':
+        i += 1
+    return i
+
+
+def minify_js(source):
+    """Drops comments, indentation, trailing spaces and blank lines.
+
+    Line breaks are kept, so automatic semicolon insertion is unaffected, and string,
+    template and regex literals are copied untouched.
+    """
+    out = []
+    # One entry per open template literal: the brace depth inside its current ${...}.
+    templates = []
+    in_template = False
+    i, n = 0, len(source)
+    while i < n:
+        ch = source[i]
+        if in_template:
+            if ch == '\\':
+                out.append(source[i:i + 2])
+                i += 2
+            elif ch == '`':
+                out.append(ch)
+                templates.pop()
+                in_template = False
+                i += 1
+            elif source.startswith('${', i):
+                out.append('${')
+                templates[-1] = 0
+                in_template = False
+                i += 2
+            else:
+                out.append(ch)
+                i += 1
+            continue
+
+        if ch in '\'"':
+            i = _read_quoted(source, i, out)
+        elif ch == '`':
+            out.append(ch)
+            templates.append(None)
+            in_template = True
+            i += 1
+        elif source.startswith('//', i):
+            i = source.find('\n', i)
+            i = n if i == -1 else i
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            if '\n' in source[i:end]:
+                i = _end_line(source, end, out)
+            else:
+                out.append(' ')
+                i = end
+        elif ch == '/' and _starts_regex(out):
+            i = _read_regex(source, i, out)
+        elif ch == '{' and templates and templates[-1] is not None:
+            templates[-1] += 1
+            out.append(ch)
+            i += 1
+        elif ch == '}' and templates and templates[-1] is not None:
+            if templates[-1] == 0:
+                templates[-1] = None
+                in_template = True
+            else:
+                templates[-1] -= 1
+            out.append(ch)
+            i += 1
+        elif ch == '\n':
+            i = _end_line(source, i + 1, out)
+        else:
+            out.append(ch)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+def minify_css(source):
+    """Drops comments and collapses whitespace, leaving quoted strings untouched."""
+    out = []
+    i, n = 0, len(source)
+    while i < n:
+        ch = source[i]
+        if ch in '\'"':
+            i = _read_quoted(source, i, out)
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+        elif ch.isspace():
+            while i < n and source[i].isspace():
+                i += 1
+            if out and out[-1][-1] not in '{};,:>' and i < n and source[i] not in '{};,>':
+                out.append(' ')
+        else:
+            if ch == '}' and out and out[-1] == ';':
+                out.pop()
+            out.append(ch)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+
+def fingerprinted(relative_path, content):
+    root, ext = os.path.splitext(relative_path)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f'dist/{root}.{digest}{ext}'
+
+
+def build():
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    manifest = {}
+    before = after = 0
+    for source_dir in SOURCE_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(STATIC_DIR, source_dir)):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                relative_path = os.path.relpath(path, STATIC_DIR).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    content = f.read()
+                minify = MINIFIERS.get(os.path.splitext(filename)[1])
+                if minify:
+                    before += len(content)
+                    content = minify(content.decode('utf-8')).encode('utf-8')
+                    after += len(content)
+                built = fingerprinted(relative_path, content)
+                os.makedirs(os.path.dirname(os.path.join(STATIC_DIR, built)), exist_ok=True)
+                with open(os.path.join(STATIC_DIR, built), 'wb') as f:
+                    f.write(content)
+                manifest[relative_path] = built
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest, before, after
+
+
+def main():
+    manifest, before, after = build()
+    print(f"Built {len(manifest)} assets into {os.path.relpath(DIST_DIR, HERE)}/; "
+          f"CSS/JS {before:,} -> {after:,} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
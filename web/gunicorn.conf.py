@@ -0,0 +1,79 @@
+"""Gunicorn configuration for the web app.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Everything is tunable from the environment:
+
+    GUNICORN_WORKER_CLASS   sync, gthread (default) or gevent
+    WEB_CONCURRENCY         worker processes (default 2)
+    GUNICORN_THREADS        threads per gthread worker (default 8)
+    GUNICORN_CONNECTIONS    concurrent connections per gevent worker (default 100)
+    GUNICORN_TIMEOUT        seconds before a silent worker is killed and replaced (default 30)
+    GUNICORN_PRELOAD        1 (default) loads the app once in the parent before forking;
+                            ignored for gevent workers, which must patch before the app loads
+    PORT                    port to bind (set by Render)
+"""
+import os
+import importlib.util
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+    print("⚠️ gevent is not installed; using gthread workers.")
+    worker_class = 'gthread'
+if worker_class == 'gevent':
+    # The app's background event loop thread doesn't mix with gevent's patched threads,
+    # and gevent already overlaps Firestore waits across requests.
+    os.environ.setdefault('ASYNC_READS', '0')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+# The app sizes its live-update stream limit from the worker class and thread count it
+# really runs with (the gevent fallback above included).
+os.environ['GUNICORN_WORKER_CLASS'] = worker_class
+os.environ['GUNICORN_THREADS'] = str(threads)
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 100))
+
+# Firestore calls give up after FIRESTORE_DEADLINE (5s by default), so a worker that is
+# silent for this long is stuck and is better replaced.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 20
+keepalive = 5
+
+# Recycle workers now and then so slow leaks (or a fragmented heap) can't accumulate;
+# the jitter keeps them from all restarting together.
+max_requests = 2000
+max_requests_jitter = 200
+
+# The app module, templates and Firebase SDK are loaded once in the parent and shared
+# copy-on-write with the workers. Each worker connects to Firestore on first use.
+# gevent workers monkey-patch only in their own init, after forking, so a preloaded app
+# would keep unpatched locks and threads; each gevent worker loads the app itself.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0' and worker_class != 'gevent'
+
+accesslog = '-'
+access_log_format = '%(h)s "%(r)s" %(s)s %(b)s %(M)sms'
+
+
+def when_ready(server):
+    if preload_app:
+        # Import the Firebase SDK once in the parent so workers share it copy-on-write.
+        # Only modules: each worker opens its own connection on first use.
+        import app
+        if app.FIREBASE_AVAILABLE:
+            app.import_firebase_sdk()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import app
+        app.reconnect_firestore()
+
+
+def post_worker_init(worker):
+    if worker_class == 'gevent':
+        # Runs after the worker's monkey-patching and before it serves (and so opens any
+        # gRPC channel), which is the window gRPC's gevent support needs.
+        import grpc.experimental.gevent
+        grpc.experimental.gevent.init_gevent()
@@ -0,0 +1,141 @@
+"""Concurrent-request load test for the web app.
+
+Measures throughput and latency of one endpoint under a fixed number of concurrent
+clients. With --compare it starts a single gunicorn worker process twice, once with
+ASYNC_READS=1 and once with ASYNC_READS=0, and prints both results side by side, so
+the async read path can be compared against the sync one per process.
+
+    cd web
+    python loadtest.py --username demo --password secret --compare
+    python loadtest.py --url https://my-app.onrender.com --username demo --password secret
+
+Needs a configured Firestore (the same credentials as the app) and an existing account.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import urllib.request
+from http.cookiejar import CookieJar
+
+
+def login(base_url, username, password):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    body = json.dumps({'username': username, 'password': password}).encode('utf-8')
+    request = urllib.request.Request(f'{base_url}/api/login', data=body, headers={'Content-Type': 'application/json'})
+    with opener.open(request, timeout=30) as response:
+        if not json.load(response).get('success'):
+            raise SystemExit('Login failed')
+    return opener
+
+
+def run_load(base_url, opener, path, concurrency, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                with opener.open(f'{base_url}{path}', timeout=30) as response:
+                    response.read()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'{base_url}/login', timeout=2).read()
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise SystemExit(f'Server at {base_url} did not start')
+
+
+def spawn_server(async_reads, threads):
+    port = free_port()
+    # Through gunicorn.conf.py, so the app sizes its thread-bound limits from these settings.
+    env = dict(os.environ, ASYNC_READS='1' if async_reads else '0', RATE_LIMIT_READS='off', RATE_LIMIT_AUTH='off',
+               GUNICORN_WORKER_CLASS='gthread', GUNICORN_THREADS=str(threads), WEB_CONCURRENCY='1')
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app', '--bind', f'127.0.0.1:{port}']
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def format_result(result):
+    return (f"{result['requests']:>9} {result['errors']:>7} {result['rps']:>9.1f} "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+
+
+def print_result(label, result):
+    print(f"{label:<10} {format_result(result)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5001', help='Base URL of a running server')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--path', default='/api/bootstrap', help='Endpoint to load (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20, help='Seconds per run')
+    parser.add_argument('--compare', action='store_true',
+                        help='Start one gunicorn worker per mode (ASYNC_READS=1 and 0) instead of using --url')
+    args = parser.parse_args()
+
+    print(f"{'mode':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    if not args.compare:
+        opener = login(args.url, args.username, args.password)
+        print_result('server', run_load(args.url, opener, args.path, args.concurrency, args.duration))
+        return
+
+    for label, async_reads in (('async', True), ('sync', False)):
+        process, base_url = spawn_server(async_reads, threads=args.concurrency)
+        try:
+            wait_until_up(base_url)
+            opener = login(base_url, args.username, args.password)
+            run_load(base_url, opener, args.path, args.concurrency, min(args.duration, 3)) # warm up
+            print_result(label, run_load(base_url, opener, args.path, args.concurrency, args.duration))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
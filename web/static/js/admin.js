@@ -1,10 +1,15 @@
 // --- MODIFICATION: Added global-like state variables ---
-let allUsers = [];
-let filteredUsers = [];
+let pageUsers = [];
+let searchQuery = "";
+let searchTimer = null;
 let currentPage = 1;
 let rowsPerPage = 15;
 let sortColumn = "username";
 let sortDirection = "asc";
+// Cursor that starts each visited page; pageCursors[0] is the first page.
+let pageCursors = [null];
+let nextCursor = null;
+let newUsersChart = null;
 // --- END MODIFICATION ---
 
 document.addEventListener("DOMContentLoaded", () => {
@@ -19,6 +24,7 @@ document.addEventListener("DOMContentLoaded", () => {
         // User is an admin, load all data
         loadAdminStats();
         loadUsers();
+        loadProfileReports();
       }
     });
 
@@ -29,6 +35,20 @@ document.addEventListener("DOMContentLoaded", () => {
   document
     .getElementById("userSearch")
     .addEventListener("input", filterUserTable);
+  document
+    .getElementById("refreshProfilesBtn")
+    .addEventListener("click", loadProfileReports);
+  document
+    .getElementById("reconcileStatsBtn")
+    .addEventListener("click", reconcileStats);
+  document
+    .getElementById("deleteSelectedBtn")
+    .addEventListener("click", deleteSelectedUsers);
+  document.getElementById("selectAllUsers").addEventListener("change", (e) => {
+    document
+      .querySelectorAll(".user-select")
+      .forEach((box) => (box.checked = e.target.checked));
+  });
 });
 
 // --- API Call Helper ---
@@ -63,8 +83,8 @@ async function apiCall(endpoint, method = "GET", body = null) {
 }
 
 // --- Data Loading Functions ---
-async function loadAdminStats() {
-  const data = await apiCall("/api/admin/stats");
+async function loadAdminStats(refresh = false) {
+  const data = await apiCall(`/api/admin/stats${refresh ? "?refresh=1" : ""}`);
   if (!data) return;
 
   document.getElementById("totalUsers").textContent = data.stats.total_users;
@@ -75,20 +95,76 @@ async function loadAdminStats() {
 
   // Render chart
   renderNewUsersChart(data.chart_data);
+  renderActivity(data);
+
+  const freshness = document.getElementById("statsFreshness");
+  const minutes = Math.floor(data.age_seconds / 60);
+  freshness.textContent = `Dashboard computed ${
+    minutes > 0 ? `${minutes} min` : `${data.age_seconds} s`
+  } ago${data.stale ? " (stale, refresh pending)" : ""}.`;
+  freshness.classList.toggle("stale", data.stale);
 }
 
-async function loadUsers() {
-  const data = await apiCall("/api/admin/users");
-  if (!data) return;
+function renderActivity(data) {
+  const fillList = (id, items) => {
+    const list = document.getElementById(id);
+    list.innerHTML = "";
+    items.forEach(([label, value]) => {
+      const li = document.createElement("li");
+      li.textContent = `${label}: ${value.toLocaleString()}`;
+      list.appendChild(li);
+    });
+  };
 
-  // --- MODIFICATION: Store data and render first page ---
-  allUsers = data.users;
-  filteredUsers = [...allUsers];
+  fillList(
+    "topBalancesList",
+    data.top_balances.map((u) => [u.username, u.balance])
+  );
+  fillList(
+    "activeUsersList",
+    Object.entries(data.activity.active_users).map(([window, n]) => [
+      `Last ${window}`,
+      n,
+    ])
+  );
+  fillList(
+    "txnHistogramList",
+    Object.entries(data.activity.txn_count_histogram).map(([bucket, n]) => [
+      `${bucket} txns`,
+      n,
+    ])
+  );
+}
 
+async function loadUsers() {
   setupSorters(); // Set up click listeners on headers
-  sortUsers(); // Perform initial sort
-  renderTablePage(); // Render the first page and pagination
-  // --- END MODIFICATION ---
+  await loadUsersPage(1);
+}
+
+// Pages are fetched from the server one at a time, already sorted.
+async function loadUsersPage(page) {
+  const params = new URLSearchParams({
+    sort: sortColumn,
+    direction: sortDirection,
+    limit: rowsPerPage,
+  });
+  const cursor = pageCursors[page - 1];
+  if (cursor) params.set("cursor", cursor);
+  if (searchQuery) params.set("q", searchQuery);
+
+  const data = await apiCall(`/api/admin/users?${params}`);
+  if (!data) return;
+
+  currentPage = page;
+  nextCursor = data.next_cursor;
+  if (nextCursor) pageCursors[page] = nextCursor;
+  pageUsers = data.users;
+  if (data.sort !== sortColumn) {
+    // Searches are always ordered by username on the server.
+    sortColumn = data.sort;
+    updateSortIndicators();
+  }
+  renderTablePage();
 }
 
 // --- MODIFICATION: New function to render a page of the table ---
@@ -96,10 +172,6 @@ function renderTablePage() {
   const tableBody = document.getElementById("userTableBody");
   tableBody.innerHTML = ""; // Clear table
 
-  const startIndex = (currentPage - 1) * rowsPerPage;
-  const endIndex = startIndex + rowsPerPage;
-  const pageUsers = filteredUsers.slice(startIndex, endIndex);
-
   pageUsers.forEach((user) => {
     const tr = document.createElement("tr");
     tr.dataset.username = user.username.toLowerCase();
@@ -122,28 +194,30 @@ function renderTablePage() {
         : "";
 
     tr.innerHTML = `
-      <td>${user.username}</td>
+      <td><input type="checkbox" class="user-select" data-uid="${
+        user.user_id
+      }" /></td>
+      <td class="username-cell"></td>
       <td class="${balanceClass}">${user.balance.toLocaleString()}</td>
       <td>${user.txn_count}</td>
       <td>${lastUpdated}</td>
       <td>${createdOn}</td>
       <td>
           <button class="btn secondary" data-uid="${user.user_id}">View</button>
-          <button class="btn danger" data-uid="${
-            user.user_id
-          }" data-username="${user.username}">Delete</button>
+          <button class="btn danger" data-uid="${user.user_id}">Delete</button>
       </td>
     `;
+    // Usernames are chosen by users, so they are set as text, never HTML.
+    tr.querySelector(".username-cell").textContent = user.username;
 
     tr.querySelector(".btn.danger").addEventListener("click", (e) => {
       const userId = e.currentTarget.dataset.uid;
-      const username = e.currentTarget.dataset.username;
       if (
         confirm(
-          `Are you sure you want to delete ${username}?\nThis is permanent and will delete all their data.`
+          `Are you sure you want to delete ${user.username}?\nThis is permanent and will delete all their data.`
         )
       ) {
-        deleteUser(userId, tr);
+        deleteUsers([userId]);
       }
     });
 
@@ -162,35 +236,21 @@ function renderTablePage() {
 function renderPaginationControls() {
   const controlsTop = document.getElementById("paginationControlsTop");
   const controlsBottom = document.getElementById("paginationControlsBottom");
-  const totalPages = Math.ceil(filteredUsers.length / rowsPerPage);
 
-  if (totalPages <= 1) {
+  if (currentPage === 1 && !nextCursor) {
     controlsTop.innerHTML = "";
     controlsBottom.innerHTML = "";
     return;
   }
 
-  let html = "";
-  html += `<button class="btn secondary" ${
-    currentPage === 1 ? "disabled" : ""
-  } data-page="${currentPage - 1}">Previous</button>`;
-
-  let startPage = Math.max(1, currentPage - 2);
-  let endPage = Math.min(totalPages, currentPage + 2);
-
-  if (startPage > 1)
-    html += `<button class="btn secondary" data-page="1">1</button><span>...</span>`;
-  for (let i = startPage; i <= endPage; i++) {
-    html += `<button class="btn ${
-      i === currentPage ? "primary" : "secondary"
-    }" data-page="${i}">${i}</button>`;
-  }
-  if (endPage < totalPages)
-    html += `<span>...</span><button class="btn secondary" data-page="${totalPages}">${totalPages}</button>`;
-
-  html += `<button class="btn secondary" ${
-    currentPage === totalPages ? "disabled" : ""
-  } data-page="${currentPage + 1}">Next</button>`;
+  const html = `
+    <button class="btn secondary" ${
+      currentPage === 1 ? "disabled" : ""
+    } data-page="${currentPage - 1}">Previous</button>
+    <span>Page ${currentPage}</span>
+    <button class="btn secondary" ${
+      nextCursor ? "" : "disabled"
+    } data-page="${currentPage + 1}">Next</button>`;
 
   controlsTop.innerHTML = html;
   controlsBottom.innerHTML = html;
@@ -199,8 +259,7 @@ function renderPaginationControls() {
     btn.addEventListener("click", (e) => {
       const page = parseInt(e.currentTarget.dataset.page);
       if (page && page !== currentPage) {
-        currentPage = page;
-        renderTablePage();
+        loadUsersPage(page);
       }
     });
   });
@@ -218,36 +277,15 @@ function setupSorters() {
         sortColumn = column;
         sortDirection = "asc";
       }
-      sortUsers();
-      currentPage = 1; // Reset to first page after sorting
-      renderTablePage();
+      pageCursors = [null]; // Cursors are only valid for one sort order
+      updateSortIndicators();
+      loadUsersPage(1);
     });
   });
+  updateSortIndicators();
 }
 
-function sortUsers() {
-  filteredUsers.sort((a, b) => {
-    let valA = a[sortColumn];
-    let valB = b[sortColumn];
-
-    // Handle different data types
-    if (sortColumn === "balance" || sortColumn === "txn_count") {
-      valA = Number(valA) || 0;
-      valB = Number(valB) || 0;
-    } else if (sortColumn === "last_updated" || sortColumn === "created_at") {
-      valA = valA === "N/A" ? 0 : new Date(valA).getTime();
-      valB = valB === "N/A" ? 0 : new Date(valB).getTime();
-    } else {
-      valA = valA.toLowerCase();
-      valB = valB.toLowerCase();
-    }
-
-    if (valA < valB) return sortDirection === "asc" ? -1 : 1;
-    if (valA > valB) return sortDirection === "asc" ? 1 : -1;
-    return 0;
-  });
-
-  // Update header classes for visual indicators
+function updateSortIndicators() {
   document.querySelectorAll("th[data-sort]").forEach((header) => {
     header.classList.remove("sort-asc", "sort-desc");
     if (header.dataset.sort === sortColumn) {
@@ -270,7 +308,8 @@ function renderNewUsersChart(chartData) {
     document.documentElement
   ).getPropertyValue("--primary-color");
 
-  new Chart(ctx, {
+  if (newUsersChart) newUsersChart.destroy();
+  newUsersChart = new Chart(ctx, {
     type: "line",
     data: {
       labels: chartData.labels, // Dates
@@ -298,18 +337,132 @@ function renderNewUsersChart(chartData) {
   });
 }
 
+// --- Request Profiles ---
+async function loadProfileReports() {
+  const data = await apiCall("/api/admin/profiling");
+  if (!data) return;
+
+  const tableBody = document.getElementById("profileTableBody");
+  tableBody.innerHTML = "";
+
+  if (data.reports.length === 0) {
+    tableBody.innerHTML = `<tr><td colspan="7">No profiles captured yet.</td></tr>`;
+    return;
+  }
+
+  data.reports.forEach((report) => {
+    const tr = document.createElement("tr");
+    tr.className = "profile-row";
+    // Paths come from any visitor's request, so cells are filled as text, never HTML.
+    [
+      new Date(report.at).toLocaleString(),
+      `${report.method} ${report.path}`,
+      report.status,
+      report.wall_ms,
+      report.cpu_ms,
+      report.peak_alloc_kb,
+      `${report.firestore.reads}r / ${report.firestore.writes}w`,
+    ].forEach((value) => {
+      const td = document.createElement("td");
+      td.textContent = value;
+      tr.appendChild(td);
+    });
+
+    const detail = document.createElement("tr");
+    detail.className = "profile-detail";
+    detail.style.display = "none";
+    const functions = report.top_functions
+      .map(
+        (f) =>
+          `${f.cumtime_ms.toFixed(2).padStart(10)} ms cum ${f.tottime_ms
+            .toFixed(2)
+            .padStart(10)} ms self ${String(f.calls).padStart(7)}x  ${
+            f.function
+          }`
+      )
+      .join("\n");
+    const allocations = report.top_allocations
+      .map((a) => `${String(a.size_kb).padStart(10)} KB ${a.count}x  ${a.location}`)
+      .join("\n");
+    detail.innerHTML = `<td colspan="7"><pre></pre></td>`;
+    detail.querySelector("pre").textContent =
+      `Top functions (cumulative):\n${functions}\n\nTop allocations:\n${allocations}` +
+      (report.error ? `\n\nError: ${report.error}` : "");
+
+    tr.addEventListener("click", () => {
+      detail.style.display = detail.style.display === "none" ? "" : "none";
+    });
+
+    tableBody.appendChild(tr);
+    tableBody.appendChild(detail);
+  });
+}
+
 // --- Action Functions ---
 
-async function deleteUser(userId, tableRow) {
-  const result = await apiCall("/api/admin/delete-user", "POST", {
-    user_id: userId,
+// Deletion runs as a server-side job; poll it until it finishes.
+async function deleteUsers(userIds) {
+  const result = await apiCall("/api/admin/delete-users", "POST", {
+    user_ids: userIds,
   });
   if (result && result.success) {
-    showToast("User deleted successfully.", "success");
-    // --- MODIFICATION: Refilter and render after delete ---
-    allUsers = allUsers.filter((u) => u.user_id !== userId);
-    filterUserTable(); // This will re-filter, re-sort, and re-render
-    // --- END MODIFICATION ---
+    showToast(`Deleting ${userIds.length} user(s)...`, "success");
+    await waitForJob(result.job_id);
+  }
+}
+
+async function deleteSelectedUsers() {
+  const userIds = [...document.querySelectorAll(".user-select:checked")].map(
+    (box) => box.dataset.uid
+  );
+  if (userIds.length === 0) {
+    showToast("Select users to delete first.", "error");
+    return;
+  }
+  if (
+    confirm(
+      `Are you sure you want to delete ${userIds.length} user(s)?\nThis is permanent and will delete all their data.`
+    )
+  ) {
+    deleteUsers(userIds);
+  }
+}
+
+async function waitForJob(jobId) {
+  while (true) {
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+    const data = await apiCall(`/api/admin/jobs/${jobId}`);
+    if (!data) return;
+
+    const job = data.job;
+    if (job.status === "queued" || job.status === "running") {
+      showToast(`Deleting users: ${job.completed}/${job.total} done`, "success");
+      continue;
+    }
+
+    if (job.status === "completed") {
+      showToast(`Deleted ${job.completed} user(s).`, "success");
+    } else {
+      showToast(
+        `Deletion ${job.status}: ${job.completed}/${job.total} done, ${
+          Object.keys(job.failed).length
+        } failed.`,
+        "error"
+      );
+    }
+    // Deleted users may have been page cursors, so start over from page one.
+    pageCursors = [null];
+    document.getElementById("selectAllUsers").checked = false;
+    loadUsersPage(1);
+    loadAdminStats(true);
+    return;
+  }
+}
+
+async function reconcileStats() {
+  const result = await apiCall("/api/admin/stats/reconcile", "POST");
+  if (result && result.success) {
+    showToast("Stats recalculated from all user data.", "success");
     loadAdminStats();
   }
 }
@@ -322,21 +475,17 @@ async function setBroadcast() {
   }
 }
 
-// --- MODIFICATION: Updated search to work with client-side pagination ---
+// --- MODIFICATION: Search runs a username prefix query on the server ---
 function filterUserTable() {
-  const searchTerm = document.getElementById("userSearch").value.toLowerCase();
-
-  if (!searchTerm) {
-    filteredUsers = [...allUsers];
-  } else {
-    filteredUsers = allUsers.filter((user) =>
-      user.username.toLowerCase().includes(searchTerm)
-    );
-  }
-
-  sortUsers(); // Re-apply current sort
-  currentPage = 1; // Reset to first page
-  renderTablePage(); // Render the filtered, sorted, and paginated result
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(() => {
+    searchQuery = document
+      .getElementById("userSearch")
+      .value.trim()
+      .toLowerCase();
+    pageCursors = [null];
+    loadUsersPage(1);
+  }, 300);
 }
 // --- END MODIFICATION ---
 
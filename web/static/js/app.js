@@ -1,3 +1,61 @@
+// Keeps the last dashboard payload between visits in IndexedDB, with the ETag it was
+// served under as its version. Failures are logged and ignored: without IndexedDB
+// (some private browsing modes) the page simply loads from the network.
+const CACHE_DB_NAME = "coin-tracker";
+const CACHE_DB_VERSION = 1;
+const CACHE_STORE = "dashboard";
+// Without a live-update stream (the server refused it, e.g. at its stream limit) the
+// dashboard refreshes this often, and tries streaming again after the longer delay.
+const LIVE_POLL_MS = 30000;
+const LIVE_RECONNECT_MS = 300000;
+
+class DashboardCache {
+  constructor() {
+    this.db = null;
+  }
+
+  open() {
+    if (!this.db) {
+      this.db = new Promise((resolve, reject) => {
+        if (!window.indexedDB) return reject(new Error("IndexedDB unavailable"));
+        const request = indexedDB.open(CACHE_DB_NAME, CACHE_DB_VERSION);
+        request.onupgradeneeded = () =>
+          request.result.createObjectStore(CACHE_STORE);
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+      });
+    }
+    return this.db;
+  }
+
+  async run(mode, operation) {
+    try {
+      const db = await this.open();
+      return await new Promise((resolve, reject) => {
+        const store = db.transaction(CACHE_STORE, mode).objectStore(CACHE_STORE);
+        const request = operation(store);
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+      });
+    } catch (error) {
+      console.warn("Dashboard cache unavailable:", error);
+      return null;
+    }
+  }
+
+  get(key) {
+    return this.run("readonly", (store) => store.get(key));
+  }
+
+  put(key, value) {
+    return this.run("readwrite", (store) => store.put(value, key));
+  }
+
+  clear() {
+    return this.run("readwrite", (store) => store.clear());
+  }
+}
+
 class CoinTrackerApp {
   constructor() {
     this.data = {
@@ -14,12 +72,22 @@ class CoinTrackerApp {
       currentPage: 1,
       totalPages: 1,
     };
+
+    // Identifies this tab so it can ignore live events caused by its own requests.
+    this.clientId = window.crypto && crypto.randomUUID
+      ? crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    this.refreshTimer = null;
+    this.pollTimer = null;
+    this.historyRows = [];
+    this.cache = new DashboardCache();
   }
 
   async init() {
     this.setupEventListeners();
     await this.loadInitialData();
     this.createHiddenFileInput();
+    this.connectLiveUpdates();
   }
 
   setupEventListeners() {
@@ -200,11 +268,25 @@ class CoinTrackerApp {
       this.showToast("Data imported successfully!", "success");
     }
   }
-  exportData() {
+  findTransaction(id) {
+    return (
+      this.data.transactions.find((t) => t.id === id) ||
+      this.historyRows.find((t) => t.id === id)
+    );
+  }
+
+  async exportData() {
     try {
+      // The dashboard only holds recent transactions; the export has them all.
+      const response = await fetch("/api/export?format=ndjson");
+      if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+      const transactions = (await response.text())
+        .split("\n")
+        .filter((line) => line)
+        .map((line) => JSON.parse(line));
       const dataToExport = {
         settings: this.data.settings,
-        transactions: this.data.transactions,
+        transactions,
       };
 
       const dataStr = JSON.stringify(dataToExport, null, 2);
@@ -249,6 +331,7 @@ class CoinTrackerApp {
         headers: {
           "Content-Type": "application/json",
           "X-Requested-With": "XMLHttpRequest",
+          "X-Client-Id": this.clientId,
         },
       };
       if (body) options.body = JSON.stringify(body);
@@ -277,38 +360,149 @@ class CoinTrackerApp {
     }
   }
 
-  async loadInitialData() {
-    const data = await this.apiCall("/api/data");
-    if (data) {
-      this.data = data;
-    } else {
-      return;
+  async batchCall(requests) {
+    // Several GET calls in one round trip, answered from one set of Firestore reads.
+    // Each request is a path or { path, etag }; each result is { status, body, etag }
+    // (status 304 and no body when the etag still matches), or null if the call failed.
+    const result = await this.apiCall("/api/batch", "POST", {
+      requests: requests.map((r) => (typeof r === "string" ? { path: r } : r)),
+    });
+    if (!result) return requests.map(() => null);
+    return result.responses.map((response) => {
+      if (response.status < 400) return response;
+      console.error(`Batched call to ${response.path} failed:`, response.body);
+      this.showToast(
+        response.body.error || "An error occurred. Please try again.",
+        "error"
+      );
+      return null;
+    });
+  }
+
+  async loadInitialData(useCache = true) {
+    // Render the last visit's dashboard from the cache at once, then revalidate it in
+    // the same round trip as the first history page; if it hasn't changed the server
+    // answers 304 and nothing is downloaded again.
+    this.historyPage.currentPage = 1;
+    const cached = useCache ? await this.cache.get("bootstrap") : null;
+    if (cached) this.renderBootstrap(cached.payload);
+
+    const [boot, history] = await this.batchCall([
+      { path: "/api/bootstrap", etag: cached ? cached.etag : null },
+      this.historyPath(1),
+    ]);
+    if (boot && boot.status === 304) {
+      this.announceBootstrap(cached.payload);
+    } else if (boot) {
+      this.renderBootstrap(boot.body);
+      this.announceBootstrap(boot.body);
+      this.cache.put("bootstrap", { etag: boot.etag, payload: boot.body });
     }
+    if (history) this.renderHistoryPage(history.body);
+  }
 
-    const profilesData = await this.apiCall("/api/profiles");
-    if (profilesData)
-      this.updateProfileDropdown(
-        profilesData.profiles,
-        profilesData.current_profile
-      );
+  renderBootstrap({ data, profiles: profilesData, user: userData }) {
+    this.data = data;
+    this.updateProfileDropdown(
+      profilesData.profiles,
+      profilesData.current_profile
+    );
 
-    const userData = await this.apiCall("/api/user");
     const usernameDisplay = document.getElementById("usernameDisplay");
-    if (userData && userData.username && usernameDisplay) {
+    if (userData.username && usernameDisplay) {
       usernameDisplay.textContent = userData.username;
     }
-    if (userData && userData.role === "admin") {
+    if (userData.role === "admin") {
       const adminBtn = document.getElementById("adminPanelBtnContainer");
       if (adminBtn) adminBtn.style.display = "block";
     }
 
-    const broadcastData = await this.apiCall("/api/broadcast");
+    this.updateAllUI();
+  }
+
+  announceBootstrap({ data, broadcast: broadcastData }) {
+    if (data.stale) {
+      this.showToast(
+        "Showing saved data while the server reconnects. Changes can't be saved yet.",
+        "error"
+      );
+    }
     if (broadcastData && broadcastData.message) {
       this.showToast(broadcastData.message, "broadcast");
     }
+  }
 
-    this.updateAllUI();
-    this.loadHistoryPage(1);
+  // --- Live Updates ---
+  // Changes made on other devices or tabs arrive as server-sent events; the browser
+  // reconnects on its own when the stream closes. A refused stream (any non-200
+  // response) is never retried by the browser, so the page polls until it can reconnect.
+  connectLiveUpdates() {
+    if (!window.EventSource) {
+      this.startPolling();
+      return;
+    }
+    const source = new EventSource("/api/events");
+    source.addEventListener("open", () => this.stopPolling());
+    source.addEventListener("error", () => {
+      if (source.readyState !== EventSource.CLOSED) return;
+      this.startPolling();
+      setTimeout(() => this.connectLiveUpdates(), LIVE_RECONNECT_MS);
+    });
+    const profileEvents = [
+      "transaction_added",
+      "transaction_updated",
+      "transaction_deleted",
+      "settings_changed",
+      "profile_replaced",
+    ];
+    profileEvents.forEach((type) =>
+      source.addEventListener(type, (e) => {
+        const event = JSON.parse(e.data);
+        if (event.origin === this.clientId) return;
+        if (event.profile !== this.data.profile) return;
+        this.scheduleRefresh();
+      })
+    );
+    source.addEventListener("profile_created", async (e) => {
+      if (JSON.parse(e.data).origin === this.clientId) return;
+      const profilesData = await this.apiCall("/api/profiles");
+      if (profilesData)
+        this.updateProfileDropdown(
+          profilesData.profiles,
+          profilesData.current_profile
+        );
+    });
+    source.addEventListener("broadcast_changed", (e) => {
+      const event = JSON.parse(e.data);
+      if (event.message) this.showToast(event.message, "broadcast");
+    });
+  }
+
+  startPolling() {
+    if (this.pollTimer) return;
+    this.pollTimer = setInterval(() => {
+      if (!document.hidden) this.scheduleRefresh();
+    }, LIVE_POLL_MS);
+  }
+
+  stopPolling() {
+    clearInterval(this.pollTimer);
+    this.pollTimer = null;
+  }
+
+  scheduleRefresh() {
+    // Coalesce bursts of events (e.g. an import on another device) into one reload.
+    clearTimeout(this.refreshTimer);
+    this.refreshTimer = setTimeout(async () => {
+      const [data, history] = await this.batchCall([
+        "/api/data",
+        this.historyPath(this.historyPage.currentPage),
+      ]);
+      if (!data) return;
+      this.data = data.body;
+      this.updateAllUI();
+      if (history) this.renderHistoryPage(history.body);
+    }, 300);
   }
 
   updateAllUI() {
@@ -439,6 +633,8 @@ class CoinTrackerApp {
 
   updateHistoryTableUI(transactions) {
     if (!transactions) return;
+    // Older rows may come from the server's archive and not be in this.data.
+    this.historyRows = transactions;
     const tbody = document.getElementById("historyTableBody");
     tbody.innerHTML = ""; // Clear table
 
@@ -472,9 +668,7 @@ class CoinTrackerApp {
       // --- MODIFICATION: Add listeners for new buttons ---
       tr.querySelector(".btn-edit").addEventListener("click", (e) => {
         const transactionId = e.currentTarget.dataset.id;
-        const transaction = this.data.transactions.find(
-          (t) => t.id === transactionId
-        );
+        const transaction = this.findTransaction(transactionId);
         if (transaction) {
           this.showTransactionModal(transaction.amount > 0, transactionId);
         }
@@ -565,10 +759,7 @@ class CoinTrackerApp {
 
   // --- History Pagination Functions ---
 
-  async loadHistoryPage(page) {
-    if (page < 1) page = 1;
-    this.historyPage.currentPage = page;
-
+  historyPath(page) {
     const fromDate = document.getElementById("dateFrom").value;
     const toDate = document.getElementById("dateTo").value;
     const searchTerm = document.getElementById("historySearch").value;
@@ -580,21 +771,28 @@ class CoinTrackerApp {
     if (searchTerm) query += `&search=${encodeURIComponent(searchTerm)}`;
     if (sourceFilter !== "all")
       query += `&source=${encodeURIComponent(sourceFilter)}`;
+    return `/api/history${query}`;
+  }
+
+  async loadHistoryPage(page) {
+    if (page < 1) page = 1;
+    this.historyPage.currentPage = page;
 
-    const data = await this.apiCall(`/api/history${query}`);
+    const data = await this.apiCall(this.historyPath(page));
+    if (data) this.renderHistoryPage(data);
+  }
 
-    if (data) {
-      this.historyPage.totalPages = data.total_pages;
-      this.updateHistoryTableUI(data.transactions);
-      this.renderPaginationControls(data.total_pages, data.current_page);
+  renderHistoryPage(data) {
+    this.historyPage.totalPages = data.total_pages;
+    this.updateHistoryTableUI(data.transactions);
+    this.renderPaginationControls(data.total_pages, data.current_page);
 
-      const summaryEl = document.getElementById("periodSummary");
-      if (summaryEl) {
-        summaryEl.innerHTML = `
-          <span class="amount-positive">Earned: +${data.total_earned.toLocaleString()}</span> / 
-          <span class="amount-negative">Spent: ${data.total_spent.toLocaleString()}</span>
-        `;
-      }
+    const summaryEl = document.getElementById("periodSummary");
+    if (summaryEl) {
+      summaryEl.innerHTML = `
+        <span class="amount-positive">Earned: +${data.total_earned.toLocaleString()}</span> / 
+        <span class="amount-negative">Spent: ${data.total_spent.toLocaleString()}</span>
+      `;
     }
   }
 
@@ -734,7 +932,7 @@ class CoinTrackerApp {
       profile_name: profileName,
     });
     if (result && result.success) {
-      await this.loadInitialData();
+      await this.loadInitialData(false);
       this.showToast(`Switched to profile: ${profileName}`, "success");
     }
   }
@@ -873,7 +1071,7 @@ class CoinTrackerApp {
   showTransactionModal(isIncome, transactionId = null) {
     const modal = document.getElementById("transactionModal");
     const transaction = transactionId
-      ? this.data.transactions.find((t) => t.id === transactionId)
+      ? this.findTransaction(transactionId)
       : null;
     modal.querySelector(".modal-title").textContent = transaction
       ? "Edit Transaction"
@@ -915,9 +1113,7 @@ class CoinTrackerApp {
 
     let isIncome = isIncomeDefault;
     if (id) {
-      const originalTransaction = this.data.transactions.find(
-        (t) => t.id === id
-      );
+      const originalTransaction = this.findTransaction(id);
       if (originalTransaction) {
         isIncome = originalTransaction.amount > 0;
       }
@@ -1016,7 +1212,7 @@ class CoinTrackerApp {
     if (result && result.success) {
       document.getElementById("profileModal").style.display = "none";
       this.showToast(`Profile '${name}' created!`, "success");
-      await this.loadInitialData();
+      await this.loadInitialData(false);
       this.updateProfileDropdown(result.profiles, result.current_profile);
     }
   }
@@ -1109,6 +1305,7 @@ class CoinTrackerApp {
     this.showToast("Logging out...", "success");
     const result = await this.apiCall("/api/logout", "POST");
     if (result && result.success) {
+      await this.cache.clear();
       window.location.href = "/login";
     }
   }
@@ -73,6 +73,8 @@ document.addEventListener("DOMContentLoaded", () => {
           toggleAuthMode();
         } else {
           showToast(`Welcome, ${result.username}!`, "success");
+          // The dashboard cache may hold another account's data.
+          if (window.indexedDB) indexedDB.deleteDatabase("coin-tracker");
           const redirectUrl = result.redirect || "/";
           setTimeout(() => {
             window.location.href = redirectUrl;